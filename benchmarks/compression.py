@@ -0,0 +1,102 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+CPU cost against bytes saved when compressing list_orders responses
+
+Builds pages shaped like the output of Order.serialize() at the sizes the
+service returns (a few orders, PAGE_SIZE_DEFAULT and PAGE_SIZE_MAX) and
+times each encoder of service.common.compression on them:
+
+    python -m benchmarks.compression [--items 3] [--repeat 20]
+"""
+import argparse
+import datetime
+import json
+import random
+import statistics
+import time
+from service.common.compression import BrotliEncoder, GzipEncoder, brotli
+
+PAGE_SIZES = (10, 100, 1000)
+SETTINGS = [("gzip", 1), ("gzip", 4), ("gzip", 6), ("gzip", 9)]
+if brotli:
+    SETTINGS += [("br", 1), ("br", 4), ("br", 11)]
+
+
+def page(orders: int, items: int) -> bytes:
+    """Returns a JSON page of orders with the given number of items each"""
+    created = datetime.datetime(2025, 1, 1)
+    body = []
+    for order_id in range(1, orders + 1):
+        moment = (created + datetime.timedelta(minutes=random.randint(0, 500000))).isoformat()
+        orderitems = [
+            {
+                "id": order_id * 10 + n,
+                "order_id": order_id,
+                "product_id": random.randint(1, 5000),
+                "quantity": random.randint(1, 10),
+                "price": round(random.uniform(1, 500), 2),
+            }
+            for n in range(items)
+        ]
+        body.append({
+            "id": order_id,
+            "customer_id": random.randint(1, 10000),
+            "order_status": random.choice(("pending", "shipped", "delivered", "canceled")),
+            "order_created": moment,
+            "order_updated": moment,
+            "item_count": items,
+            "total_amount": round(sum(i["quantity"] * i["price"] for i in orderitems), 2),
+            "orderitems": orderitems,
+        })
+    return json.dumps(body).encode("utf-8")
+
+
+def measure(body: bytes, name: str, level: int, repeat: int) -> tuple:
+    """Returns the compressed size and the median time in seconds"""
+    timings = []
+    for _ in range(repeat):
+        encoder = GzipEncoder(level) if name == "gzip" else BrotliEncoder(level)
+        start = time.perf_counter()
+        size = len(encoder.finish(body))
+        timings.append(time.perf_counter() - start)
+    return size, statistics.median(timings)
+
+
+def main():
+    """Prints a table of size, ratio and CPU time per page size and setting"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=3, help="items per order")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per measurement")
+    args = parser.parse_args()
+    random.seed(1)
+
+    print(f"{'orders':>6} {'raw KB':>8} {'encoding':>9} {'KB':>8} {'ratio':>6} {'ms':>8} {'MB/s':>7} {'KB saved/ms':>11}")
+    for orders in PAGE_SIZES:
+        body = page(orders, args.items)
+        for name, level in SETTINGS:
+            size, seconds = measure(body, name, level, args.repeat)
+            saved = (len(body) - size) / 1024
+            print(
+                f"{orders:>6} {len(body) / 1024:>8.1f} {f'{name}-{level}':>9} {size / 1024:>8.1f} "
+                f"{len(body) / size:>6.1f} {seconds * 1000:>8.2f} {len(body) / seconds / 1e6:>7.0f} "
+                f"{saved / (seconds * 1000):>11.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,471 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Latency, throughput and statements of every order and item route
+
+Seeds the database of DATABASE_URI with a dataset of 1k, 100k or 1M
+orders built by tests/factories.py, with 1 to 8 items each (2.8 on
+average), then sends each route the same seeded sequence of requests
+through the WSGI app and compares the results with a stored baseline:
+
+    python -m benchmarks.routes [--dataset 1k|100k|1m] [--requests 200] [--repeat 3] [--tolerance 0.25]
+                                [--baseline benchmarks/baseline.json] [--update-baseline] [--keep]
+
+Every route is measured --repeat times, one pass over all of them after
+the other, and each value is the median of its passes. A route regresses
+when its median p50 latency grows, or its throughput shrinks, by more than
+the tolerance, or when it runs more statements per request than the
+baseline allows. p95 and p99 are reported but not compared, a few hundred
+requests are too few for a tail to be stable. Statements per request
+depend on how often the order cache hits, which grows with the number of
+requests, so a baseline only compares with runs of the --requests and
+--repeat it was recorded with. The exit status is 1 when a route
+regressed, so CI can run the benchmark on the machine that recorded the
+baseline.
+
+The dataset belongs to customers from DATASET_CUSTOMERS on, and the
+orders the write routes create to customers from WRITE_CUSTOMERS on, so
+neither touches other orders. With --keep the dataset is left in place
+and reused by the next run of the same size, which saves the minutes it
+takes to seed 1M orders.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import factory
+from factory.random import reseed_random
+from sqlalchemy import event, insert, select
+from wsgi import app
+from service.models import db, migrations, Order, OrderItems
+from tests.factories import OrderFactory, OrderItemsFactory
+
+DATASETS = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+DATASET_CUSTOMERS = 1_000_000_000
+WRITE_CUSTOMERS = 2_000_000_000
+ORDERS_PER_CUSTOMER = 10
+# Items per order and how often each count occurs
+ITEM_FANOUT = (1, 2, 3, 4, 5, 6, 7, 8)
+ITEM_WEIGHTS = (30, 25, 17, 11, 7, 5, 3, 2)
+SEED_CHUNK = 10_000
+SAMPLED_ORDERS = 1_000
+BATCH_SIZE = 20
+WARM_UP = 20
+# Statements per request may differ by a cache miss or so between runs
+QUERY_SLACK = 0.1
+COMPARED = ("p50_ms", "rps", "queries")
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+######################################################################
+#  D A T A S E T
+######################################################################
+class Dataset:  # pylint: disable=too-few-public-methods
+    """The seeded orders and customers, and the orders created by the write routes"""
+
+    def __init__(self, ids: list, items: list, customers: int):
+        self.ids = ids
+        self.items = items
+        self.customers = customers
+        self.created = []
+        self.created_items = []
+        self.batches = []
+
+    def customer(self) -> int:
+        """Returns a random customer of the dataset"""
+        return DATASET_CUSTOMERS + random.randrange(self.customers)
+
+    def forget_writes(self) -> None:
+        """Forgets the orders, items and batches of the write routes once they are deleted"""
+        self.created, self.created_items, self.batches = [], [], []
+
+
+def dataset_orders():
+    """Returns the criterion that selects the orders of the dataset"""
+    return Order.customer_id.between(DATASET_CUSTOMERS, WRITE_CUSTOMERS - 1)
+
+
+def new_items(count: int, order_id=None) -> list:
+    """Builds count items with the factory, as rows of order_items"""
+    return [
+        {"order_id": order_id, "product_id": item.product_id, "quantity": item.quantity, "price": item.price}
+        for item in OrderItemsFactory.build_batch(
+            count,
+            order=None,
+            order_id=order_id,
+            product_id=factory.LazyFunction(lambda: random.randint(1, 5000)),
+            quantity=factory.LazyFunction(lambda: random.randint(1, 5)),
+            price=factory.LazyFunction(lambda: round(random.uniform(1, 200), 2)),
+        )
+    ]
+
+
+def seed(orders: int) -> None:
+    """Replaces the dataset with orders built by the factories"""
+    db.session.execute(db.delete(Order).where(dataset_orders()))
+    db.session.commit()
+    customers = max(orders // ORDERS_PER_CUSTOMER, 1)
+    started = time.monotonic()
+    for start in range(0, orders, SEED_CHUNK):
+        rows = [
+            {
+                "customer_id": DATASET_CUSTOMERS + random.randrange(customers),
+                "order_status": order.order_status,
+                "order_created": order.order_created,
+                "order_updated": order.order_updated,
+            }
+            for order in OrderFactory.build_batch(min(SEED_CHUNK, orders - start))
+        ]
+        ids = db.session.scalars(insert(Order).returning(Order.id), rows).all()
+        items = [item for order_id in ids for item in new_items(random.choices(ITEM_FANOUT, ITEM_WEIGHTS)[0], order_id)]
+        # One multi-row INSERT per chunk fires the statement triggers once
+        for first in range(0, len(items), SEED_CHUNK):
+            db.session.execute(insert(OrderItems).values(items[first:first + SEED_CHUNK]))
+        db.session.commit()
+        print(f"  seeded {start + len(ids)} orders in {time.monotonic() - started:.0f}s", file=sys.stderr)
+    # The triggers plan badly on tables whose statistics predate the seed
+    db.session.execute(db.text('ANALYZE "order"'))
+    db.session.execute(db.text("ANALYZE order_items"))
+    db.session.commit()
+
+
+def load_dataset(orders: int, reseed: bool = False) -> Dataset:
+    """Returns the dataset of orders orders, seeding it unless a kept one has that size"""
+    db.session.execute(db.delete(Order).where(Order.customer_id >= WRITE_CUSTOMERS))
+    db.session.commit()
+    ids = db.session.scalars(select(Order.id).where(dataset_orders()).order_by(Order.id)).all()
+    if reseed or len(ids) != orders:
+        seed(orders)
+        ids = db.session.scalars(select(Order.id).where(dataset_orders()).order_by(Order.id)).all()
+    sampled = random.sample(ids, min(SAMPLED_ORDERS, len(ids)))
+    items = db.session.execute(select(OrderItems.order_id, OrderItems.id).where(OrderItems.order_id.in_(sampled))).all()
+    db.session.remove()
+    return Dataset(ids, [tuple(item) for item in items], max(orders // ORDERS_PER_CUSTOMER, 1))
+
+
+def new_order(customer_id: int) -> dict:
+    """Builds the body of a pending order with 3 items"""
+    order = OrderFactory.build(customer_id=customer_id, order_status="pending")
+    return {
+        "customer_id": order.customer_id,
+        "order_status": order.order_status,
+        "order_created": order.order_created.isoformat(),
+        "order_updated": order.order_created.isoformat(),
+        "orderitems": new_items(3),
+    }
+
+
+######################################################################
+#  S C E N A R I O S
+######################################################################
+# Each scenario yields (method, path, body) and is sent the response
+
+def get_orders(data: Dataset, count: int):
+    """Reads single orders, which the order cache serves after their first read"""
+    for _ in range(count):
+        yield "GET", f"/orders/{random.choice(data.ids)}", None
+
+
+def list_orders_page(data: Dataset, count: int):  # pylint: disable=unused-argument
+    """Reads the first page of 100 orders"""
+    for _ in range(count):
+        yield "GET", "/orders?limit=100", None
+
+
+def list_orders_customer(data: Dataset, count: int):
+    """Reads the orders of a customer"""
+    for _ in range(count):
+        yield "GET", f"/orders?customer={data.customer()}", None
+
+
+def list_orders_sparse(data: Dataset, count: int):
+    """Reads two columns of the orders of a customer, without their items"""
+    for _ in range(count):
+        yield "GET", f"/orders?customer={data.customer()}&fields=customer_id,total_amount", None
+
+
+def list_orders_filtered(data: Dataset, count: int):  # pylint: disable=unused-argument
+    """Reads a page of the orders of a status in a range of totals"""
+    for _ in range(count):
+        yield "GET", f"/orders?status=Shipped&min_total={random.randint(1, 500)}&min_items=2&limit=20", None
+
+
+def list_orders_stream(data: Dataset, count: int):
+    """Streams the orders of a customer"""
+    for _ in range(count):
+        yield "GET", f"/orders?customer={data.customer()}&stream=true", None
+
+
+def list_orderitems(data: Dataset, count: int):
+    """Reads the items of an order"""
+    for _ in range(count):
+        yield "GET", f"/orders/{random.choice(data.ids)}/items", None
+
+
+def get_orderitem(data: Dataset, count: int):
+    """Reads single items"""
+    for _ in range(count):
+        order_id, item_id = random.choice(data.items)
+        yield "GET", f"/orders/{order_id}/items/{item_id}", None
+
+
+def get_customer_summary(data: Dataset, count: int):
+    """Summarizes the orders of a customer"""
+    for _ in range(count):
+        yield "GET", f"/customers/{data.customer()}/summary", None
+
+
+def create_order(data: Dataset, count: int):
+    """Creates orders with 3 items"""
+    for number in range(count):
+        response = yield "POST", "/orders", new_order(WRITE_CUSTOMERS + number)
+        data.created.append(response.get_json()["id"])
+
+
+def create_orders_batch(data: Dataset, count: int):
+    """Creates batches of orders, all of a customer of their own"""
+    for number in range(count):
+        customer_id = WRITE_CUSTOMERS + count + number
+        yield "POST", "/orders/batch", [new_order(customer_id) for _ in range(BATCH_SIZE)]
+        data.batches.append(customer_id)
+
+
+def create_orderitem(data: Dataset, count: int):
+    """Adds an item to the created orders"""
+    for number in range(count):
+        order_id = data.created[number % len(data.created)]
+        response = yield "POST", f"/orders/{order_id}/items", new_items(1)[0]
+        data.created_items.append((order_id, response.get_json()["id"]))
+
+
+def update_orders(data: Dataset, count: int):
+    """Updates the created orders, keeping them pending"""
+    for number in range(count):
+        order_id = data.created[number % len(data.created)]
+        yield "PUT", f"/orders/{order_id}", {"customer_id": WRITE_CUSTOMERS + number, "order_status": "pending"}
+
+
+def update_items(data: Dataset, count: int):
+    """Updates the created items"""
+    for number in range(count):
+        order_id, item_id = data.created_items[number % len(data.created_items)]
+        yield "PUT", f"/orders/{order_id}/items/{item_id}", {**new_items(1)[0], "order_id": order_id}
+
+
+def transition_orders(data: Dataset, count: int):
+    """Ships the orders of the batches, one customer at a time"""
+    for number in range(count):
+        customer_id = data.batches[number % len(data.batches)]
+        yield "POST", "/orders/transition", {"status": "shipped", "filters": {"customer": customer_id}}
+
+
+def cancel_order(data: Dataset, count: int):
+    """Cancels the created orders, which are pending"""
+    for number in range(count):
+        yield "PUT", f"/orders/{data.created[number % len(data.created)]}/cancel", None
+
+
+def delete_orderitem(data: Dataset, count: int):
+    """Deletes the created items"""
+    for number in range(count):
+        order_id, item_id = data.created_items[number % len(data.created_items)]
+        yield "DELETE", f"/orders/{order_id}/items/{item_id}", None
+
+
+def delete_order(data: Dataset, count: int):
+    """Deletes the created orders"""
+    for number in range(count):
+        yield "DELETE", f"/orders/{data.created[number % len(data.created)]}", None
+
+
+# In order: the write scenarios work on the orders of the ones before them
+READS = (
+    get_orders, list_orders_page, list_orders_customer, list_orders_sparse, list_orders_filtered,
+    list_orders_stream, list_orderitems, get_orderitem, get_customer_summary,
+)
+WRITES = (
+    create_order, create_orders_batch, create_orderitem, update_orders, update_items, transition_orders,
+    cancel_order, delete_orderitem, delete_order,
+)
+
+
+######################################################################
+#  M E A S U R E M E N T
+######################################################################
+def send(client, requests) -> list:
+    """Sends the requests of a scenario one after the other and returns their latencies"""
+    latencies = []
+    response = None
+    while True:
+        try:
+            method, path, body = requests.send(response)
+        except StopIteration:
+            return latencies
+        sent = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        latencies.append(time.perf_counter() - sent)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} answered {response.status_code}: {response.get_data(True)[:200]}")
+
+
+def run(client, engine, scenario, data: Dataset, count: int) -> dict:
+    """Sends the requests of a scenario and returns its latency percentiles, throughput and statements"""
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    statements = []
+
+    def count_statement(*args):  # pylint: disable=unused-argument
+        statements.append(None)
+
+    event.listen(engine, "before_cursor_execute", count_statement)
+    try:
+        started = time.perf_counter()
+        latencies = send(client, scenario(data, count))
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "queries": round(len(statements) / len(latencies), 2),
+    }
+
+
+def run_all(client, engine, data: Dataset, count: int) -> dict:
+    """Runs every scenario once, in order, and deletes the orders the write routes created"""
+    results = {}
+    try:
+        for scenario in READS + WRITES:
+            if scenario in READS:
+                run(client, engine, scenario, data, WARM_UP)
+            results[scenario.__name__] = run(client, engine, scenario, data, count)
+    finally:
+        with app.app_context():
+            db.session.execute(db.delete(Order).where(Order.customer_id >= WRITE_CUSTOMERS))
+            db.session.commit()
+        data.forget_writes()
+    return results
+
+
+def medians(passes: list) -> dict:
+    """Returns the median of every value of every route over the results of several passes"""
+    return {
+        name: {key: statistics.median(results[name][key] for results in passes) for key in result}
+        for name, result in passes[0].items()
+    }
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns a description of every compared value that is worse than its baseline allows"""
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in COMPARED:
+            if key == "rps":
+                worse = result[key] < base[key] / (1 + tolerance)
+            elif key == "queries":
+                worse = result[key] > base[key] + QUERY_SLACK
+            else:
+                worse = result[key] > base[key] * (1 + tolerance)
+            if worse:
+                found.append(f"{name}: {key} {result[key]} against {base[key]}")
+    return found
+
+
+def report(results: dict, baseline: dict) -> None:
+    """Prints the results, with the change of the compared values from their baseline"""
+    print(f"{'route':<22} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}  vs baseline")
+    for name, result in results.items():
+        base = baseline.get(name)
+        change = "new" if base is None else " ".join(
+            f"{key} {(result[key] / base[key] - 1) * 100:+.0f}%" for key in ("p50_ms", "p95_ms", "rps") if base[key]
+        )
+        print(
+            f"{name:<22} {result['rps']:>8.0f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+            f"{result['p99_ms']:>8.2f} {result['queries']:>8.2f}  {change}"
+        )
+
+
+def main():
+    """Benchmarks every route on a dataset and compares the results with the baseline"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dataset", choices=DATASETS, default="1k", help="orders to seed")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the routes, their median is kept")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 for 25%%")
+    parser.add_argument("--baseline", default=BASELINE, help="JSON file of the baseline results")
+    parser.add_argument("--update-baseline", action="store_true", help="record this run as the baseline")
+    parser.add_argument("--reseed", action="store_true", help="seed the dataset even if a kept one fits")
+    parser.add_argument("--keep", action="store_true", help="leave the dataset for the next run")
+    args = parser.parse_args()
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            stored = json.load(file)
+    baseline = stored.get(args.dataset, {})
+    recorded = (baseline.get("requests"), baseline.get("repeat"))
+    if baseline and not args.update_baseline and recorded != (args.requests, args.repeat):
+        parser.error(
+            f"the {args.dataset} baseline was recorded with --requests {recorded[0]} --repeat {recorded[1]}, "
+            "run with those or record a new one with --update-baseline"
+        )
+    random.seed(1)
+    reseed_random(1)
+    # The app logs every request at INFO, which would weigh on the timings
+    app.logger.setLevel(logging.WARNING)
+    client = app.test_client()
+
+    # Requests must not run in this context, or they would share its session
+    with app.app_context():
+        migrations.upgrade(db.engine)
+        engine = db.engine
+        data = load_dataset(DATASETS[args.dataset], args.reseed)
+    try:
+        results = medians([run_all(client, engine, data, args.requests) for _ in range(args.repeat)])
+    finally:
+        if not args.keep:
+            with app.app_context():
+                db.session.execute(db.delete(Order).where(dataset_orders()))
+                db.session.commit()
+
+    report(results, baseline.get("routes", {}))
+    if args.update_baseline:
+        stored[args.dataset] = {"requests": args.requests, "repeat": args.repeat, "routes": results}
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(stored, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Recorded the baseline of {args.dataset} in {args.baseline}")
+        return
+    found = regressions(results, baseline.get("routes", {}), args.tolerance)
+    for regression in found:
+        print(f"REGRESSION {regression}")
+    if found:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
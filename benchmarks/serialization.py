@@ -0,0 +1,139 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Time to turn a list of orders into a JSON body
+
+Compares the hand written serialize() with Flask's default provider, as
+the service used to work, against the precompiled serializers with
+FastJSONProvider on the standard library and on orjson (when installed):
+
+    python -m benchmarks.serialization [--orders 10000] [--items 3] [--repeat 5]
+"""
+import argparse
+import datetime
+import gc
+import statistics
+import time
+from unittest.mock import patch
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from service.common import json_provider
+from service.common.json_provider import FastJSONProvider
+from service.models import Order, OrderItems
+
+
+def legacy_serialize(order: Order) -> dict:
+    """Order.serialize() as it was written before the serializers"""
+    data = {
+        "id": order.id,
+        "customer_id": order.customer_id,
+        "order_status": order.order_status,
+        "order_created": order.order_created,
+        "order_updated": order.order_updated,
+        "item_count": order.item_count,
+        "total_amount": order.total_amount,
+        "orderitems": [],
+    }
+    for item in order.orderitems:
+        data["orderitems"].append({
+            "id": item.id,
+            "order_id": item.order_id,
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "price": item.price,
+        })
+    return data
+
+
+def transient(model, **values):
+    """Returns a transient record of model with the given column values"""
+    record = model()
+    for name, value in values.items():
+        setattr(record, name, value)
+    return record
+
+
+def make_orders(count: int, items: int) -> list:
+    """Returns transient orders shaped like the ones in the database"""
+    created = datetime.datetime(2025, 1, 1, 8, 30, 12, 123456)
+    orders = []
+    for order_id in range(1, count + 1):
+        order = transient(
+            Order, id=order_id, customer_id=order_id % 977, order_status="pending", order_created=created,
+            order_updated=created, item_count=items, total_amount=9.99 * items, row_version=1,
+        )
+        order.orderitems = [
+            transient(OrderItems, id=order_id * 10 + n, order_id=order_id, product_id=n, quantity=1, price=9.99)
+            for n in range(items)
+        ]
+        orders.append(order)
+    return orders
+
+
+def measure(repeat: int, function) -> tuple:
+    """Returns the median time of function() in seconds and its last result"""
+    timings = []
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return statistics.median(timings), result
+
+
+def main():
+    """Prints the serialize and encode time of each variant"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--orders", type=int, default=10000, help="orders per list")
+    parser.add_argument("--items", type=int, default=3, help="items per order")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    default_provider, fast_provider = DefaultJSONProvider(app), FastJSONProvider(app)
+    variants = [
+        ("serialize() + default provider", legacy_serialize, default_provider, False),
+        ("serializers + stdlib json", Order.serialize, fast_provider, True),
+    ]
+    if json_provider.orjson:
+        variants.append(("serializers + orjson", Order.serialize, fast_provider, False))
+
+    print(f"{args.orders} orders with {args.items} items each")
+    report(variants, make_orders(args.orders, args.items), args.repeat)
+
+
+def report(variants: list, orders: list, repeat: int) -> None:
+    """Measures and prints each variant, the first one being the baseline"""
+    print(f"{'variant':<32} {'serialize ms':>12} {'encode ms':>10} {'total ms':>9} {'speedup':>8} {'KB':>8}")
+    baseline = None
+    for name, serialize, provider, stdlib in variants:
+        with patch.object(json_provider, "orjson", None if stdlib else json_provider.orjson):
+            build, data = measure(repeat, lambda s=serialize: [s(order) for order in orders])
+            encode, body = measure(repeat, lambda p=provider, d=data: p.dumps(d))
+        total = build + encode
+        baseline = baseline or total
+        print(
+            f"{name:<32} {build * 1000:>12.1f} {encode * 1000:>10.1f} {total * 1000:>9.1f} "
+            f"{baseline / total:>7.1f}x {len(body) / 1024:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Gunicorn configuration
+
+Every setting can be overridden from the environment. The defaults run
+threaded (gthread) workers: requests spend most of their time waiting on
+PostgreSQL, and a thread waiting on a socket costs far less than a process.
+See benchmarks/workers.py for the measurements behind them.
+
+Each thread of a worker holds at most one connection of the worker's pool,
+so GUNICORN_THREADS should not be larger than DB_POOL_SIZE + DB_MAX_OVERFLOW.
+"""
+# pylint: disable=invalid-name, wrong-import-position
+import glob
+import os
+import tempfile
+
+# The workers of this server share one metrics directory, chosen before
+# service.config reads the environment. A temporary one is only made when
+# none was set, so restarts do not leave empty directories behind.
+METRICS_DIR = os.environ.get("METRICS_DIR") or tempfile.mkdtemp(prefix="orders-metrics-")
+os.environ["METRICS_DIR"] = METRICS_DIR
+
+from service.config import DB_MAX_OVERFLOW, DB_POOL_SIZE  # noqa: E402
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+backlog = int(os.getenv("GUNICORN_BACKLOG", "2048"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# Create the app once in the master and fork the workers from it. Creating
+# it opens no connection, and connections opened later by the master are
+# replaced in each worker (see service.models.pool).
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def on_starting(server):
+    """Drops the metrics of a previous run and checks the threads against the pool"""
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.db")):
+        os.remove(path)
+    connections = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    if worker_class == "gthread" and threads > connections:
+        server.log.warning(
+            "%d threads per worker share %d connections, requests will wait for the pool",
+            threads,
+            connections,
+        )
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    """Closes the order cache LISTEN connection, exports the spans and writes the stack samples of a worker"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.profiling import sampler
+    from service.common.tracing import tracer
+    from service.models.cache import listener
+
+    listener.stop()
+    tracer.shutdown()
+    sampler.shutdown()
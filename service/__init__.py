@@ -22,6 +22,11 @@ import sys
 from flask import Flask
 from service import config
 from service.common import log_handlers
+from service.common.compression import CompressionMiddleware
+from service.common.json_provider import FastJSONProvider
+from service.common.metrics import init_metrics
+from service.common.profiling import init_profiling
+from service.common.tracing import init_tracing
 
 
 ############################################################
@@ -32,12 +37,28 @@ def create_app():
     # Create Flask application
     app = Flask(__name__)
     app.config.from_object(config)
+    app.json = FastJSONProvider(app)
 
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
-    from service.models import db
+    from service.models import db, migrations, cache, pool, replicas, statements
 
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = pool.engine_options(app)
     db.init_app(app)
+    # First, so that the span of a request covers the other hooks
+    init_tracing(app)
+    pool.init_pool(app, db)
+    replicas.init_replicas(app)
+    cache.init_cache(app)
+    statements.init_statements(app)
+    init_metrics(app)
+    init_profiling(app)
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app,
+        min_size=app.config["COMPRESSION_MIN_SIZE"],
+        level=app.config["COMPRESSION_LEVEL"],
+        brotli_quality=app.config["BROTLI_QUALITY"],
+    )
 
     with app.app_context():
         # Dependencies require we import the routes AFTER the Flask app is created
@@ -45,20 +66,19 @@ def create_app():
         from service import routes, models  # noqa: F401 E402
         from service.common import error_handlers, cli_commands  # noqa: F401, E402
 
-        try:
-            db.create_all()
-        except Exception as error:  # pylint: disable=broad-except
-            app.logger.critical("%s: Cannot continue", error)
-            # gunicorn requires exit code 4 to stop spawning workers when they die
-            sys.exit(4)
+        # Creating the app opens no connection. The schema is migrated once
+        # per release with `flask db-upgrade`, or here for development when
+        # DB_AUTO_MIGRATE is set, since every worker would wait on the lock
+        if app.config["DB_AUTO_MIGRATE"]:
+            try:
+                migrations.upgrade(db.engine)
+            except Exception as error:  # pylint: disable=broad-except
+                app.logger.critical("%s: Cannot continue", error)
+                # gunicorn requires exit code 4 to stop spawning workers when they die
+                sys.exit(4)
 
         # Set up logging for production
         log_handlers.init_logging(app, "gunicorn.error")
-
-        app.logger.info(70 * "*")
-        app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
-        app.logger.info(70 * "*")
-
         app.logger.info("Service initialized!")
 
         return app
@@ -16,8 +16,11 @@
 """
 Flask CLI Command Extensions
 """
+import sys
+import click
 from flask import current_app as app  # Import Flask application
-from service.models import db
+from sqlalchemy import text
+from service.models import db, migrations
 
 
 ######################################################################
@@ -32,5 +35,42 @@ def db_create():
     production. ;-)
     """
     db.drop_all()
-    db.create_all()
+    db.session.execute(text("DROP TABLE IF EXISTS schema_migrations"))
     db.session.commit()
+    migrations.upgrade(db.engine)
+
+
+######################################################################
+# Command to apply the pending schema migrations
+# Usage:
+#   flask db-upgrade [--target VERSION]
+######################################################################
+@app.cli.command("db-upgrade")
+@click.option("--target", type=int, default=None, help="Version to upgrade to (default: latest)")
+def db_upgrade(target):
+    """Applies the schema migrations that have not been applied yet"""
+    applied = migrations.upgrade(db.engine, target)
+    for migration in applied:
+        click.echo(f"Applied {migration.version}: {migration.description}")
+    if not applied:
+        click.echo("Database schema is up to date")
+
+
+######################################################################
+# Command to report the schema version and any drift from the models
+# Usage:
+#   flask db-status
+######################################################################
+@app.cli.command("db-status")
+def db_status():
+    """Reports pending migrations and differences between the database and the models"""
+    pending = migrations.pending_migrations(db.engine)
+    problems = migrations.check_schema(db.engine)
+    click.echo(f"Latest version: {migrations.latest_version()}")
+    for migration in pending:
+        click.echo(f"Pending {migration.version}: {migration.description}")
+    for problem in problems:
+        click.echo(f"Drift: {problem}")
+    if pending or problems:
+        sys.exit(1)
+    click.echo("Database schema matches the models")
@@ -0,0 +1,162 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+
+"""
+Negotiated response compression
+
+CompressionMiddleware wraps the WSGI app and compresses JSON and text
+responses with brotli (when the brotli package is installed) or gzip,
+whichever the client's Accept-Encoding prefers. Bodies with a known
+length below a threshold are sent as they are. Streamed bodies, which
+have no Content-Length, are compressed chunk by chunk and flushed after
+every chunk so that they keep streaming.
+"""
+import zlib
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, quote_etag, unquote_etag
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+class GzipEncoder:
+    """Incremental gzip encoder"""
+
+    name = "gzip"
+
+    def __init__(self, level: int):
+        # wbits 16 + 15 writes a gzip header and trailer around the deflate stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compresses data and flushes it so the client can decode it right away"""
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        """Compresses the last data and ends the stream"""
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class BrotliEncoder:
+    """Incremental brotli encoder"""
+
+    name = "br"
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compresses data and flushes it so the client can decode it right away"""
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        """Compresses the last data and ends the stream"""
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class CompressionMiddleware:  # pylint: disable=too-few-public-methods
+    """WSGI middleware that compresses responses the client accepts compressed"""
+
+    def __init__(self, app, min_size: int = 1024, level: int = 4, brotli_quality: int = 4):
+        """
+        Args:
+            app: the WSGI application to wrap
+            min_size (int): bodies of a known length below this are not compressed
+            level (int): gzip compression level, 1 (fastest) to 9 (smallest)
+            brotli_quality (int): brotli quality, 0 (fastest) to 11 (smallest)
+        """
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.encodings = ["br", "gzip"] if brotli else ["gzip"]
+
+    def __call__(self, environ, start_response):
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured.update(status=status, headers=Headers(headers), exc_info=exc_info)
+            return lambda data: None
+
+        app_iter = self.app(environ, capture)
+        headers = captured["headers"]
+        if not self._compressible(captured["status"], headers):
+            start_response(captured["status"], headers.to_wsgi_list(), captured["exc_info"])
+            return app_iter
+
+        headers.add("Vary", "Accept-Encoding")
+        encoder = self._encoder(environ)
+        length = headers.get("Content-Length", type=int)
+        if encoder is None or environ["REQUEST_METHOD"] == "HEAD" or (length is not None and length < self.min_size):
+            start_response(captured["status"], headers.to_wsgi_list(), captured["exc_info"])
+            return app_iter
+
+        headers["Content-Encoding"] = encoder.name
+        # The encoded bytes are a different representation than the tag was made for
+        etag, weak = unquote_etag(headers.get("ETag"))
+        if etag and not weak:
+            headers["ETag"] = quote_etag(etag, weak=True)
+        if length is None:
+            start_response(captured["status"], headers.to_wsgi_list(), captured["exc_info"])
+            return self._stream(app_iter, encoder)
+
+        try:
+            body = encoder.finish(b"".join(app_iter))
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+        headers["Content-Length"] = str(len(body))
+        start_response(captured["status"], headers.to_wsgi_list(), captured["exc_info"])
+        return [body]
+
+    @staticmethod
+    def _compressible(status: str, headers: Headers) -> bool:
+        """Returns True for responses with a body of a compressible type"""
+        code = int(status.split(" ", 1)[0])
+        return (
+            code >= 200
+            and code not in (204, 304)
+            and "Content-Encoding" not in headers
+            and "no-transform" not in headers.get("Cache-Control", "")
+            and headers.get("Content-Type", "").startswith(COMPRESSIBLE_TYPES)
+        )
+
+    def _encoder(self, environ):
+        """Returns an encoder for the best encoding the client accepts, or None"""
+        accepted = parse_accept_header(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        best = accepted.best_match(self.encodings)
+        if best == "br":
+            return BrotliEncoder(self.brotli_quality)
+        if best == "gzip":
+            return GzipEncoder(self.level)
+        return None
+
+    @staticmethod
+    def _stream(app_iter, encoder):
+        """Compresses a streamed body one chunk at a time"""
+        try:
+            for data in app_iter:
+                if data:
+                    yield encoder.chunk(data)
+            yield encoder.finish()
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
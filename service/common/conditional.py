@@ -0,0 +1,67 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+
+"""
+Conditional GET support
+
+Entity tags are derived from what identifies a representation, such as
+the row_version of an order, instead of from the serialized body, so a
+request can be answered with 304 Not Modified before anything is loaded
+or serialized.
+"""
+import hashlib
+from flask import Response, request
+from service.common import status
+
+# Change whenever the JSON representation of orders or items changes, so
+# that tags handed out by an older release stop matching
+REPRESENTATION_VERSION = 3
+
+
+def make_etag(*parts) -> str:
+    """Returns a strong entity tag for the representation identified by parts"""
+    key = repr((REPRESENTATION_VERSION,) + parts).encode("utf-8")
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+
+def is_conditional() -> bool:
+    """Returns True if the request carries an If-None-Match header"""
+    return bool(request.if_none_match)
+
+
+def is_fresh(etag: str) -> bool:
+    """
+    Returns True if the client's If-None-Match already names etag
+
+    A bare '*' is not honored, answering it would require knowing that the
+    resource exists, which is what the tag lookup avoids.
+    """
+    tags = request.if_none_match
+    return not tags.star_tag and tags.contains_weak(etag)
+
+
+def not_modified(etag: str) -> Response:
+    """Returns an empty 304 Not Modified response carrying etag"""
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+
+def with_etag(response: Response, etag: str) -> Response:
+    """Sets the ETag header of response and returns it"""
+    response.set_etag(etag)
+    return response
@@ -44,6 +44,31 @@ def bad_request(error):
     )
 
 
+@app.errorhandler(status.HTTP_401_UNAUTHORIZED)
+def unauthorized(error):
+    """Handles requests without valid credentials with 401_UNAUTHORIZED"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_401_UNAUTHORIZED, error="Unauthorized", message=message
+        ),
+        status.HTTP_401_UNAUTHORIZED,
+        {"WWW-Authenticate": "Bearer"},
+    )
+
+
+@app.errorhandler(status.HTTP_403_FORBIDDEN)
+def forbidden(error):
+    """Handles requests whose credentials are not valid with 403_FORBIDDEN"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_403_FORBIDDEN, error="Forbidden", message=message),
+        status.HTTP_403_FORBIDDEN,
+    )
+
+
 @app.errorhandler(status.HTTP_404_NOT_FOUND)
 def not_found(error):
     """Handles resources not found with 404_NOT_FOUND"""
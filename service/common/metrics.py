@@ -0,0 +1,265 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request metrics in the Prometheus text format
+
+Every worker process adds its samples to a memory mapped file of its own
+in METRICS_DIR, so recording a request is a few in-place float updates
+and no lock is shared between processes. GET /metrics reads the files of
+every worker in the directory and sums them, so one scrape covers the
+whole pod whichever worker answers it.
+
+A file is a 8 byte header holding the number of bytes in use, followed by
+entries of a 4 byte key length, the UTF-8 key padded to 8 byte alignment
+and a float64 value. Entries are only ever appended, and the header is
+updated after the entry is written, so readers never see a partial one.
+"""
+import bisect
+import functools
+import glob
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from flask import g, request
+
+logger = logging.getLogger("flask.app")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+REQUESTS = "http_requests_total"
+DURATION = "http_request_duration_seconds"
+STATEMENTS = "db_statements_total"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HELP = {
+    REQUESTS: ("counter", "Requests served, by route and status code"),
+    DURATION: ("histogram", "Time spent handling requests, by route and status code"),
+    STATEMENTS: ("counter", "SQL statements executed while handling requests, by route"),
+}
+
+HEADER = struct.Struct("q")
+LENGTH = struct.Struct("i")
+VALUE = struct.Struct("d")
+
+
+######################################################################
+#  P E R   P R O C E S S   S T O R E
+######################################################################
+class MmapStore:
+    """Float values keyed by strings, in a file that only this process writes"""
+
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+b") as file:
+            if os.fstat(fd).st_size < HEADER.size:
+                file.truncate(self.INITIAL_SIZE)
+                file.write(HEADER.pack(HEADER.size))
+                file.flush()
+            self._map = mmap.mmap(fd, 0)
+        self._used = HEADER.unpack_from(self._map)[0]
+        self._offsets = {key: offset for key, offset, _ in read_entries(self._map, self._used)}
+
+    def inc(self, samples) -> None:
+        """Adds every (key, amount) pair of samples to the values of their keys"""
+        with self._lock:
+            for key, amount in samples:
+                offset = self._offsets.get(key)
+                if offset is None:
+                    offset = self._append(key)
+                VALUE.pack_into(self._map, offset, VALUE.unpack_from(self._map, offset)[0] + amount)
+
+    def _append(self, key: str) -> int:
+        encoded = key.encode("utf-8")
+        padded = -(-(LENGTH.size + len(encoded)) // 8) * 8 - LENGTH.size
+        entry = LENGTH.pack(len(encoded)) + encoded.ljust(padded, b"\0") + VALUE.pack(0.0)
+        while self._used + len(entry) > len(self._map):
+            self._map.resize(len(self._map) * 2)
+        self._map[self._used:self._used + len(entry)] = entry
+        offset = self._used + LENGTH.size + padded
+        self._used += len(entry)
+        HEADER.pack_into(self._map, 0, self._used)
+        self._offsets[key] = offset
+        return offset
+
+    def close(self) -> None:
+        """Unmaps the file"""
+        self._map.close()
+
+
+def read_entries(data, used: int):
+    """Yields the (key, value offset, value) of every entry in the first used bytes"""
+    position = HEADER.size
+    while position < used:
+        length = LENGTH.unpack_from(data, position)[0]
+        key = bytes(data[position + LENGTH.size:position + LENGTH.size + length]).decode("utf-8")
+        offset = position + LENGTH.size + -(-(LENGTH.size + length) // 8) * 8 - LENGTH.size
+        yield key, offset, VALUE.unpack_from(data, offset)[0]
+        position = offset + VALUE.size
+
+
+######################################################################
+#  R E G I S T R Y
+######################################################################
+class Metrics:
+    """Records requests into the store of the current process and reads every store"""
+
+    def __init__(self):
+        self.directory = None
+        self._store = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, directory: str) -> None:
+        """Writes to, and reads from, the files in directory"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._store = self._pid = None
+
+    @property
+    def enabled(self) -> bool:
+        """Returns False until a directory was configured"""
+        return self.directory is not None
+
+    def store(self) -> MmapStore:
+        """Returns the store of this process, a forked worker gets a new one"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._store = MmapStore(os.path.join(self.directory, f"metrics-{os.getpid()}.db"))
+                    self._pid = os.getpid()
+        return self._store
+
+    def observe(self, method: str, route: str, code: int, seconds: float, statements: int) -> None:
+        """Records one request"""
+        labels = label_string(method, route, code)
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        samples = [(f"{DURATION}_bucket\t{labels}\t{bucket}", 1.0), (f"{DURATION}_sum\t{labels}", seconds)]
+        if statements:
+            samples.append((f"{STATEMENTS}\t{route_label(route)}", statements))
+        self.store().inc(samples)
+
+    def collect(self) -> dict:
+        """Returns the sum of every key over the files of all processes"""
+        totals = {}
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.db")):
+            try:
+                with open(path, "rb") as file:
+                    data = file.read()
+            except FileNotFoundError:  # pragma: no cover - removed while listing
+                continue
+            for key, _, value in read_entries(data, HEADER.unpack_from(data)[0]):
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format"""
+        return render(self.collect())
+
+    def clear(self) -> None:
+        """Removes the files of every process, for a server that starts over"""
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.db")):
+            os.remove(path)
+        self._store = self._pid = None
+
+
+metrics = Metrics()
+
+
+@functools.lru_cache(maxsize=1024)
+def label_string(method: str, route: str, code: int) -> str:
+    """Returns the labels of a request, formatted once per distinct combination"""
+    return f'method="{escape(method)}",route="{escape(route)}",status="{code}"'
+
+
+@functools.lru_cache(maxsize=256)
+def route_label(route: str) -> str:
+    """Returns the label of a route"""
+    return f'route="{escape(route)}"'
+
+
+def escape(value: str) -> str:
+    """Escapes a label value"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render(totals: dict) -> str:
+    """Formats the summed samples, deriving request counts and cumulative buckets"""
+    buckets, sums, statements = {}, {}, {}
+    for key, value in totals.items():
+        name, labels, *rest = key.split("\t")
+        if name == f"{DURATION}_bucket":
+            buckets.setdefault(labels, [0.0] * (len(BUCKETS) + 1))[int(rest[0])] += value
+        elif name == f"{DURATION}_sum":
+            sums[labels] = value
+        elif name == STATEMENTS:
+            statements[labels] = value
+
+    lines = header(REQUESTS)
+    lines += [f"{REQUESTS}{{{labels}}} {sum(counts)}" for labels, counts in sorted(buckets.items())]
+    lines += header(DURATION)
+    for labels, counts in sorted(buckets.items()):
+        cumulative = 0.0
+        for bound, count in zip(BUCKETS + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f'{DURATION}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{DURATION}_sum{{{labels}}} {sums.get(labels, 0.0)}")
+        lines.append(f"{DURATION}_count{{{labels}}} {cumulative}")
+    lines += header(STATEMENTS)
+    lines += [f"{STATEMENTS}{{{labels}}} {value}" for labels, value in sorted(statements.items())]
+    return "\n".join(lines) + "\n"
+
+
+def header(name: str) -> list:
+    """Returns the HELP and TYPE lines of a metric"""
+    kind, text = HELP[name]
+    return [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+
+
+######################################################################
+#  F L A S K   H O O K S
+######################################################################
+def start_timer() -> None:
+    """Notes when the request started"""
+    g.metrics_started = time.perf_counter()
+
+
+def record_request(response):
+    """Records the route, status, duration and statement count (see service.models.statements) of the request"""
+    started = g.pop("metrics_started", None)
+    if started is not None and metrics.enabled:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe(
+            request.method, route, response.status_code, time.perf_counter() - started, g.get("db_statements", 0)
+        )
+    return response
+
+
+def init_metrics(app) -> None:
+    """Records every request when METRICS_ENABLED, into files in METRICS_DIR"""
+    if not app.config["METRICS_ENABLED"]:
+        return
+    directory = app.config["METRICS_DIR"] or tempfile.mkdtemp(prefix="orders-metrics-")
+    metrics.configure(directory)
+    logger.info("Recording metrics in %s", directory)
+    app.before_request(start_timer)
+    app.after_request(record_request)
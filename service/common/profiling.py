@@ -0,0 +1,302 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Profiling of production workers
+
+A request that carries an X-Profile header or a profile query parameter,
+and the ADMIN_TOKEN as a bearer token, runs under cProfile. Its stats are
+saved in PROFILE_DIR, which the workers of a server share, and named in
+the X-Profile-Id header of the response so that GET /admin/profiles/<id>
+serves them to `python -m pstats` or snakeviz. Only the code that runs
+before the response is returned is profiled, not the generator of a
+streamed body.
+
+With SAMPLER_INTERVAL_MS set, a thread of each worker also samples the
+stacks of the other threads, which costs a few microseconds per thread and
+sample instead of slowing every call like cProfile does. Every
+SAMPLER_WINDOW_SECONDS the samples are written to PROFILE_DIR as collapsed
+stacks, one "thread;frame;...;frame count" line per distinct stack, ready
+for flamegraph.pl or speedscope.
+"""
+import atexit
+import collections
+import cProfile
+import glob
+import hmac
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from flask import g, request
+
+logger = logging.getLogger("flask.app")
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_PARAM = "profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PSTATS = ".pstats"
+FOLDED = ".folded"
+
+
+######################################################################
+#  P R O F I L E   F I L E S
+######################################################################
+class ProfileStore:
+    """The profiles of every worker of a server, kept in one directory"""
+
+    def __init__(self):
+        self.directory = None
+        self.keep = 50
+        self._sequence = itertools.count()
+
+    def configure(self, directory: str, keep: int) -> None:
+        """Keeps the keep latest profiles of each kind in directory, a temporary one when empty"""
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "orders-profiles")
+        self.keep = keep
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        """Returns the path of a profile, None if name is not one of them"""
+        if self.directory is None or os.path.basename(name) != name or not name.endswith((PSTATS, FOLDED)):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def new_path(self, prefix: str, suffix: str) -> str:
+        """Returns the path of a new profile, dropping the oldest ones of its kind"""
+        paths = sorted(glob.glob(os.path.join(self.directory, f"*{suffix}")), key=os.path.getmtime)
+        for old in paths[:max(len(paths) - self.keep + 1, 0)]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass  # another worker removed it first
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        return os.path.join(self.directory, f"{prefix}-{stamp}-{os.getpid()}-{next(self._sequence)}{suffix}")
+
+    def entries(self) -> list:
+        """Returns the name, size and modification time of every profile, the latest first"""
+        if self.directory is None:
+            return []
+        found = []
+        for path in glob.glob(os.path.join(self.directory, "*")):
+            if path.endswith((PSTATS, FOLDED)):
+                stat = os.stat(path)
+                found.append({"id": os.path.basename(path), "bytes": stat.st_size, "modified": stat.st_mtime})
+        return sorted(found, key=lambda profile: profile["modified"], reverse=True)
+
+
+profiles = ProfileStore()
+
+
+######################################################################
+#  O N   D E M A N D   R E Q U E S T   P R O F I L E S
+######################################################################
+class RequestProfiler:
+    """Runs the requests that ask for it under cProfile, one at a time per worker"""
+
+    def __init__(self):
+        self.token = ""
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Returns False while no ADMIN_TOKEN was configured"""
+        return bool(self.token)
+
+    @staticmethod
+    def bearer_token() -> str:
+        """Returns the bearer token of the request, empty when it has none"""
+        scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+        return credentials.strip() if scheme.lower() == "bearer" else ""
+
+    def is_admin(self) -> bool:
+        """Returns True if the request carries the admin token as a bearer token"""
+        return self.enabled and hmac.compare_digest(self.bearer_token().encode(), self.token.encode())
+
+    def wanted(self) -> bool:
+        """Returns True if the request asks to be profiled and may be"""
+        if PROFILE_HEADER not in request.headers and PROFILE_PARAM not in request.args:
+            return False
+        return self.is_admin()
+
+    def start(self):
+        """Returns a running profile, None while another request of this worker is profiled"""
+        # cProfile only follows the calling thread, but two profiles would
+        # each hold the overhead of the other
+        if not self._lock.acquire(blocking=False):
+            logger.warning("A request is already being profiled, %s %s runs without", request.method, request.path)
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile, name: str = None) -> str:
+        """Stops a profile and saves it when named, returning the id of its file"""
+        profile.disable()
+        self._lock.release()
+        if name is None:
+            return None
+        path = profiles.new_path(name, PSTATS)
+        profile.dump_stats(path)
+        return os.path.basename(path)
+
+
+request_profiler = RequestProfiler()
+
+
+######################################################################
+#  S T A C K   S A M P L I N G
+######################################################################
+def frame_label(frame) -> str:
+    """Names a frame after its function and where the function starts"""
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+def collapse(frame) -> tuple:
+    """Returns the labels of a stack, its outermost frame first"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return tuple(reversed(labels))
+
+
+class StackSampler:
+    """Counts the stacks of the threads of this process from a thread of its own"""
+
+    def __init__(self):
+        self.interval = None
+        self.window = 60.0
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = None
+
+    def configure(self, interval_ms: float, window: float) -> None:
+        """Samples every interval_ms (0 disables the sampler) and writes a file every window seconds"""
+        self.shutdown()
+        self.interval = interval_ms / 1000 if interval_ms > 0 else None
+        self.window = window
+
+    @property
+    def enabled(self) -> bool:
+        """Returns False when no interval was configured"""
+        return self.interval is not None
+
+    def ensure_started(self) -> None:
+        """Starts the thread of this process, after a fork included"""
+        if self._pid == os.getpid() or not self.enabled:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Stacks counted before a fork belong to the parent
+                self._stacks.clear()
+                self.samples = 0
+                self._pid = os.getpid()
+                self._stop = threading.Event()
+                threading.Thread(target=self._run, args=(self._stop,), name="stack-sampler", daemon=True).start()
+
+    def _run(self, stop: threading.Event) -> None:
+        written = time.monotonic()
+        while not stop.wait(self.interval):
+            self.sample()
+            if time.monotonic() - written >= self.window:
+                written = time.monotonic()
+                self.write()
+
+    def sample(self) -> None:
+        """Counts the current stack of every other thread"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        stacks = [
+            (names.get(ident, str(ident)).replace(";", ":"),) + collapse(frame)
+            for ident, frame in frames.items()
+            if ident != own
+        ]
+        with self._lock:
+            self._stacks.update(stacks)
+            self.samples += 1
+
+    def write(self) -> str:
+        """Writes the stacks counted since the last write, returning the path of the file"""
+        with self._lock:
+            stacks, self._stacks = self._stacks, collections.Counter()
+        if not stacks:
+            return None
+        path = profiles.new_path("stacks", FOLDED)
+        with open(path, "w", encoding="utf-8") as file:
+            file.writelines(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+        return path
+
+    def shutdown(self) -> None:
+        """Stops the thread and writes the stacks it counted"""
+        with self._lock:
+            running = self._pid == os.getpid()
+            self._pid = None
+            if self._stop is not None:
+                self._stop.set()
+        if running:
+            self.write()
+
+
+sampler = StackSampler()
+atexit.register(sampler.shutdown)
+
+
+######################################################################
+#  F L A S K   H O O K S
+######################################################################
+def start_request_profile() -> None:
+    """Starts the sampler of this worker, and profiles the request when asked to"""
+    sampler.ensure_started()
+    if request_profiler.enabled and request_profiler.wanted():
+        profile = request_profiler.start()
+        if profile is not None:
+            g.profile = profile
+
+
+def end_request_profile(response):
+    """Saves the profile of the request and names it in the response"""
+    profile = g.pop("profile", None)
+    if profile is not None:
+        endpoint = (request.endpoint or "unmatched").replace(".", "-")
+        response.headers[PROFILE_ID_HEADER] = request_profiler.stop(profile, f"{request.method.lower()}-{endpoint}")
+    return response
+
+
+def abandon_request_profile(error=None) -> None:  # pylint: disable=unused-argument
+    """Stops the profile of a request that raised before it had a response"""
+    profile = g.pop("profile", None)
+    if profile is not None:
+        request_profiler.stop(profile)
+
+
+def init_profiling(app) -> None:
+    """Profiles the requests of app on demand and samples its stacks, as configured"""
+    request_profiler.token = app.config["ADMIN_TOKEN"]
+    sampler.configure(app.config["SAMPLER_INTERVAL_MS"], app.config["SAMPLER_WINDOW_SECONDS"])
+    if request_profiler.enabled or sampler.enabled:
+        profiles.configure(app.config["PROFILE_DIR"], app.config["PROFILE_KEEP"])
+    app.before_request(start_request_profile)
+    app.after_request(end_request_profile)
+    app.teardown_request(abandon_request_profile)
@@ -0,0 +1,58 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Streaming JSON responses
+
+Collection endpoints can send their results as a JSON array that is
+written while the rows are still being fetched from a server-side cursor,
+so memory use does not grow with the size of the result.
+"""
+from flask import Response, current_app, stream_with_context
+
+
+def wants_stream(args) -> bool:
+    """Returns True if the client asked for a streamed response with ?stream=true"""
+    return args.get("stream", "").lower() in ("true", "1", "yes")
+
+
+def json_array_chunks(rows, serialize, chunk_bytes: int):
+    """
+    Generates a JSON array of the serialized rows, roughly chunk_bytes at a time
+
+    Args:
+        rows: an iterable of model instances
+        serialize: callable that converts one row into a JSON compatible value
+        chunk_bytes (int): how much output to collect before yielding it
+    """
+    dumps = current_app.json.dumps
+    buffer, size, separator = ["["], 1, ""
+    for row in rows:
+        piece = separator + dumps(serialize(row))
+        separator = ","
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_bytes:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    buffer.append("]")
+    yield "".join(buffer)
+
+
+def stream_json_array(rows, serialize, status_code: int = 200) -> Response:
+    """Returns a response that streams the rows as a JSON array"""
+    chunks = json_array_chunks(rows, serialize, current_app.config["STREAM_CHUNK_BYTES"])
+    return Response(stream_with_context(chunks), status=status_code, mimetype="application/json")
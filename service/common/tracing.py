@@ -0,0 +1,399 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request tracing with W3C Trace Context propagation
+
+Every request gets a server span, continuing the trace of its traceparent
+header when it has one. Spans for the PersistentBase methods (see traced),
+the JSON provider and every SQL statement (see service.models.statements)
+are its children. A request whose trace is not sampled creates no other
+span, so tracing can stay on with a low TRACING_SAMPLE_RATIO.
+
+A trace is sampled when its traceparent says so, otherwise when its id
+falls under TRACING_SAMPLE_RATIO, like OpenTelemetry's ParentBased and
+TraceIdRatioBased samplers. Finished spans are queued and exported in
+batches by a thread of each worker, as OTLP/JSON, to a file or a
+collector's /v1/traces endpoint, or to any exporter given as
+"module:factory" in TRACING_EXPORTER.
+"""
+import atexit
+import contextlib
+import contextvars
+import functools
+import importlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import urllib.request
+from flask import g, request
+
+logger = logging.getLogger("flask.app")
+
+# Span kinds of OTLP
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(?:-.*)?$")
+INVALID_TRACE_ID = "0" * 32
+INVALID_SPAN_ID = "0" * 16
+
+# The span that new spans of this thread or task are children of
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+######################################################################
+#  S P A N S
+######################################################################
+class Span:
+    """A timed operation of a trace"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "sampled", "start_ns", "end_ns", "attributes",
+                 "status", "message")
+
+    def __init__(self, trace_id: str, parent_id: str, name: str, kind: int, sampled: bool, attributes: dict = None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64) or 1:016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.status = STATUS_OK
+        self.message = None
+
+    def set_error(self, error) -> None:
+        """Marks the span as failed"""
+        self.status = STATUS_ERROR
+        self.message = str(error) if error is not None else None
+
+    @property
+    def traceparent(self) -> str:
+        """Returns the traceparent header that continues the trace from this span"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_otlp(self) -> dict:
+        """Returns the span in the OTLP/JSON encoding"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": otlp_attributes(self.attributes),
+            "status": {"code": self.status, **({"message": self.message} if self.message else {})},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def parse_traceparent(header: str) -> tuple:
+    """Returns the (trace id, parent span id, sampled) of a traceparent header, None if it is invalid"""
+    match = TRACEPARENT.match((header or "").strip())
+    if not match:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == "ff" or (version == "00" and len(header.strip()) != 55):
+        return None
+    if trace_id == INVALID_TRACE_ID or parent_id == INVALID_SPAN_ID:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def otlp_attributes(attributes: dict) -> list:
+    """Returns attributes as OTLP key values"""
+    encoded = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        encoded.append({"key": key, "value": typed})
+    return encoded
+
+
+######################################################################
+#  E X P O R T E R S
+######################################################################
+def otlp_request(spans: list, service_name: str) -> dict:
+    """Returns an ExportTraceServiceRequest of spans in the OTLP/JSON encoding"""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": otlp_attributes({"service.name": service_name, "process.pid": os.getpid()})},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp() for span in spans]}],
+            }
+        ]
+    }
+
+
+class FileExporter:
+    """Appends every batch to a file as one line of OTLP/JSON"""
+
+    def __init__(self, path: str, service_name: str = "orders"):
+        self.path = path
+        self.service_name = service_name
+
+    def export(self, spans: list) -> None:
+        """Writes the spans in a single append, so the lines of workers sharing the file do not mix"""
+        line = json.dumps(otlp_request(spans, self.service_name), separators=(",", ":")) + "\n"
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def shutdown(self) -> None:
+        """Nothing to release, the file is opened for every batch"""
+
+
+class OTLPExporter:
+    """Posts every batch to an OTLP/HTTP collector in the JSON encoding"""
+
+    def __init__(self, endpoint: str, service_name: str = "orders", timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def export(self, spans: list) -> None:
+        """Sends the spans, raising an OSError when the collector cannot be reached"""
+        body = json.dumps(otlp_request(spans, self.service_name), separators=(",", ":")).encode("utf-8")
+        post = urllib.request.Request(
+            self.endpoint, data=body, headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(post, timeout=self.timeout) as response:  # nosec - configured endpoint
+            response.read()
+
+    def shutdown(self) -> None:
+        """Nothing to release, every batch opens its own connection"""
+
+
+def make_exporter(config):
+    """Returns the exporter named by TRACING_EXPORTER, None when tracing is off"""
+    name = config["TRACING_EXPORTER"]
+    if not name:
+        return None
+    if name == "file":
+        return FileExporter(config["TRACING_FILE"], config["TRACING_SERVICE_NAME"])
+    if name == "otlp":
+        return OTLPExporter(config["TRACING_OTLP_ENDPOINT"], config["TRACING_SERVICE_NAME"])
+    module, _, factory = name.partition(":")
+    return getattr(importlib.import_module(module), factory)(config)
+
+
+######################################################################
+#  B A T C H I N G   A N D   T H E   T R A C E R
+######################################################################
+class BatchProcessor:
+    """Queues finished spans and exports them from a thread of the current process"""
+
+    def __init__(self, exporter, max_batch: int = 512, max_queue: int = 4096, interval: float = 5.0):
+        self.exporter = exporter
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.interval = interval
+        self.dropped = 0
+        self._spans = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def add(self, span: Span) -> None:
+        """Queues a span, dropping it when the exporter cannot keep up"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Spans queued before a fork belong to the parent
+                self._spans.clear()
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="span-exporter", daemon=True).start()
+            if len(self._spans) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._spans.append(span)
+            if len(self._spans) >= self.max_batch:
+                self._wake.set()
+
+    def _run(self) -> None:
+        pid = os.getpid()
+        while self._pid == pid:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """Exports every queued span"""
+        with self._lock:
+            spans, self._spans = self._spans, []
+        for start in range(0, len(spans), self.max_batch):
+            try:
+                self.exporter.export(spans[start:start + self.max_batch])
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Cannot export %d spans: %s", len(spans[start:start + self.max_batch]), error)
+
+    def shutdown(self) -> None:
+        """Stops the thread, exports the queued spans and releases the exporter"""
+        with self._lock:
+            self._pid = None
+        self._wake.set()
+        self.flush()
+        self.exporter.shutdown()
+
+
+class Tracer:
+    """Starts spans and hands the finished ones of sampled traces to a processor"""
+
+    def __init__(self):
+        self.ratio = 0.0
+        self.processor = None
+
+    def configure(self, exporter, ratio: float, **options) -> None:
+        """Exports spans to exporter (None turns tracing off) and samples ratio of the new traces"""
+        self.shutdown()
+        self.ratio = min(max(ratio, 0.0), 1.0)
+        self.processor = BatchProcessor(exporter, **options) if exporter is not None else None
+
+    @property
+    def enabled(self) -> bool:
+        """Returns False until an exporter was configured"""
+        return self.processor is not None
+
+    def start_trace(self, traceparent: str, name: str, attributes: dict = None) -> Span:
+        """Returns the server span of a request, continuing the trace of traceparent if it is valid"""
+        parent = parse_traceparent(traceparent)
+        if parent is None:
+            trace_id = f"{random.getrandbits(128) or 1:032x}"
+            # TraceIdRatioBased compares the lower 8 bytes of the id
+            return Span(trace_id, None, name, SERVER, int(trace_id[16:], 16) < self.ratio * 2**64, attributes)
+        trace_id, parent_id, sampled = parent
+        return Span(trace_id, parent_id, name, SERVER, sampled, attributes)
+
+    def start_span(self, name: str, kind: int = INTERNAL, attributes: dict = None):
+        """Returns a child of the current span if its trace is sampled, else None"""
+        parent = current_span.get()
+        if parent is None or not parent.sampled:
+            return None
+        return Span(parent.trace_id, parent.span_id, name, kind, True, attributes)
+
+    def finish(self, span, error=None) -> None:
+        """Ends a span and queues it for export"""
+        if span is None:
+            return
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.set_error(error)
+        if span.sampled and self.processor is not None:
+            self.processor.add(span)
+
+    @contextlib.contextmanager
+    def span(self, name: str, kind: int = INTERNAL, attributes: dict = None):
+        """Runs a block in a child span of the current one, yields None when the trace is not sampled"""
+        span = self.start_span(name, kind, attributes)
+        if span is None:
+            yield None
+            return
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.set_error(error)
+            raise
+        finally:
+            current_span.reset(token)
+            self.finish(span)
+
+    def shutdown(self) -> None:
+        """Exports the spans still queued"""
+        if self.processor is not None:
+            self.processor.shutdown()
+
+
+tracer = Tracer()
+atexit.register(tracer.shutdown)
+
+
+def traced(method):
+    """Runs a method, or the function of a classmethod, in a span named after its class"""
+
+    @functools.wraps(method)
+    def wrapper(owner, *args, **kwargs):
+        parent = current_span.get()
+        if parent is None or not parent.sampled:
+            return method(owner, *args, **kwargs)
+        cls = owner if isinstance(owner, type) else type(owner)
+        with tracer.span(f"{cls.__name__}.{method.__name__}"):
+            return method(owner, *args, **kwargs)
+
+    return wrapper
+
+
+######################################################################
+#  F L A S K   H O O K S
+######################################################################
+def start_request_span() -> None:
+    """Starts the server span of a request and makes it the current span"""
+    if not tracer.enabled:
+        return
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    span = tracer.start_trace(
+        request.headers.get("traceparent"),
+        f"{request.method} {route}",
+        {"http.request.method": request.method, "http.route": route, "url.path": request.path},
+    )
+    g.trace_span = span
+    g.trace_token = current_span.set(span)
+
+
+def end_request_span(response):
+    """Records the status of the request and returns its trace to the client"""
+    span = g.get("trace_span")
+    if span is not None:
+        span.attributes["http.response.status_code"] = response.status_code
+        if response.status_code >= 500:
+            span.status = STATUS_ERROR
+        # Trace Context Level 2, so that a client can look a slow request up
+        response.headers["traceresponse"] = span.traceparent
+    return response
+
+
+def finish_request_span(error=None) -> None:
+    """Ends the server span once the response was sent, streamed ones included"""
+    span = g.pop("trace_span", None)
+    token = g.pop("trace_token", None)
+    if span is not None:
+        current_span.reset(token)
+        tracer.finish(span, error)
+
+
+def init_tracing(app) -> None:
+    """Traces the requests of app to the exporter of TRACING_EXPORTER, if any"""
+    exporter = make_exporter(app.config)
+    if exporter is not None:
+        tracer.configure(exporter, app.config["TRACING_SAMPLE_RATIO"])
+        logger.info("Tracing %.0f%% of the requests to %s", tracer.ratio * 100, app.config["TRACING_EXPORTER"])
+    app.before_request(start_request_span)
+    app.after_request(end_request_span)
+    app.teardown_request(finish_request_span)
@@ -5,5 +5,10 @@ All of the models are stored in this package
 """
 
 from .persistent_base import db, DataValidationError
-from .orderitems import OrderItems
-from .order import Order
+from .orderitems import OrderItems, ITEM_FILTERS
+from .order import Order, ORDER_FILTERS, order_serializer
+from .filters import Filter, FilterSet
+from .pagination import Page, keyset_query, paginate, parse_limit
+from .cache import order_cache, cached_order, peek_order
+from .pool import pool_stats
+from .statements import slow_queries
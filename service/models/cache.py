@@ -0,0 +1,301 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Read-through cache of serialized orders
+
+Each entry is a serialized order and its row_version, read together so
+that the entity tag of a cached order always matches its body. Each worker
+keeps the most recently read orders in a size bounded LRU whose entries
+also expire after a TTL. Entries are invalidated two ways:
+
+* locally, as soon as a transaction that wrote an order commits. The
+  session events below collect the ids of the orders touched by every
+  flush and by every bulk statement (see invalidate_on_commit).
+* in every other worker and replica, by a LISTEN thread that receives the
+  ids a trigger on "order" sends with pg_notify (migration 6). NOTIFY is
+  transactional, so nothing is announced for a rollback.
+
+A generation counter that moves on every invalidation keeps a read that
+started before a write committed from putting the old version back.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+import psycopg
+from sqlalchemy import event
+from .persistent_base import db, CACHE_KEYS, ALL_KEYS
+from .replicas import on_primary
+
+logger = logging.getLogger("flask.app")
+
+CHANNEL = "order_cache"
+
+
+######################################################################
+#  L R U   C A C H E   W I T H   T T L
+######################################################################
+class OrderCache:
+    """A thread safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.generation = 0
+        self.counters = Counter(hits=0, misses=0, evictions=0, invalidations=0)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize: int, ttl: float) -> None:
+        """Changes the size and TTL, dropping every entry"""
+        with self._lock:
+            self.maxsize, self.ttl = maxsize, ttl
+            self._entries.clear()
+            self.generation += 1
+
+    @property
+    def enabled(self) -> bool:
+        """Returns False when the cache was configured with a size of 0"""
+        return self.maxsize > 0
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.counters["misses"] += 1
+            return None
+
+    def set(self, key, value, generation: int = None) -> None:
+        """Caches value, unless something was invalidated since generation was read"""
+        with self._lock:
+            if not self.enabled or (generation is not None and generation != self.generation):
+                return
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def get_or_load(self, key, loader):
+        """Returns the cached value for key, calling loader() and caching its result on a miss"""
+        value = self.get(key)
+        if value is None:
+            generation = self.generation
+            value = loader()
+            if value is not None:
+                self.set(key, value, generation)
+        return value
+
+    def invalidate(self, keys) -> None:
+        """Drops the given keys, or everything if ALL_KEYS is one of them"""
+        with self._lock:
+            self.generation += 1
+            if ALL_KEYS in keys:
+                self.counters["invalidations"] += len(self._entries)
+                self._entries.clear()
+                return
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.counters["invalidations"] += 1
+
+    def clear(self) -> None:
+        """Drops every entry"""
+        self.invalidate({ALL_KEYS})
+
+    def stats(self) -> dict:
+        """Returns the counters of the cache"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                **self.counters,
+            }
+
+
+order_cache = OrderCache()
+
+
+def parse_payload(payload: str) -> set:
+    """Converts a notification payload of comma separated ids (or '*') into cache keys"""
+    keys = set()
+    for part in payload.split(","):
+        part = part.strip()
+        if part == ALL_KEYS:
+            keys.add(ALL_KEYS)
+        elif part.isdigit():
+            keys.add(int(part))
+    return keys
+
+
+######################################################################
+#  C R O S S   W O R K E R   I N V A L I D A T I O N
+######################################################################
+class InvalidationListener:
+    """Runs a thread that LISTENs for order changes made by any process"""
+
+    def __init__(self, cache: OrderCache, channel: str = CHANNEL):
+        self.cache = cache
+        self.channel = channel
+        self.connected = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self) -> None:
+        """Starts the thread in this process, if it is not running yet
+
+        Called on every cached read, so a worker forked by gunicorn after the
+        app was loaded starts its own listener the first time it needs one.
+        """
+        if self._running():
+            return
+        with self._lock:
+            if self._running():
+                return
+            self._stop.clear()
+            self.connected.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, args=(listener_url(),), name="order-cache-listener", daemon=True
+            )
+            self._thread.start()
+
+    def _running(self) -> bool:
+        return self._pid == os.getpid() and self._thread.is_alive()
+
+    def stop(self) -> None:
+        """Asks the thread to finish and waits for it"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self, url: str) -> None:
+        """Listens until stopped, reconnecting after errors"""
+        while not self._stop.is_set():
+            try:
+                self._listen(url)
+            except psycopg.Error as error:
+                self.connected.clear()
+                logger.warning("Order cache listener lost its connection: %s", error)
+                self._stop.wait(1.0)
+        self.connected.clear()
+
+    def _listen(self, url: str) -> None:
+        with psycopg.connect(url, autocommit=True) as connection:
+            connection.execute(f"LISTEN {self.channel}")
+            # Notifications sent while nobody listened are lost, start clean
+            self.cache.clear()
+            self.connected.set()
+            logger.info("Order cache listening for invalidations on %s", self.channel)
+            while not self._stop.is_set():
+                for notify in connection.notifies(timeout=1.0):
+                    self.cache.invalidate(parse_payload(notify.payload))
+
+
+listener = InvalidationListener(order_cache)
+
+
+def init_cache(app) -> None:
+    """Sizes the cache from ORDER_CACHE_SIZE and ORDER_CACHE_TTL"""
+    order_cache.configure(app.config["ORDER_CACHE_SIZE"], app.config["ORDER_CACHE_TTL"])
+
+
+def listener_url() -> str:
+    """Returns the libpq URL of the database the app uses"""
+    return db.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def cached_order(order_id: int, loader) -> tuple:
+    """
+    Returns the serialized order with this id and its row_version, calling loader() on a miss
+
+    Until the listener is connected writes made by other workers could go
+    unnoticed, so reads skip the cache rather than risk serving them stale.
+    Misses are read from the primary: a lagging replica could hand back the
+    version an invalidation just dropped, to be served until the TTL.
+    """
+    if not trusted():
+        return loader()
+    with on_primary():
+        return order_cache.get_or_load(order_id, loader)
+
+
+def peek_order(order_id: int) -> tuple:
+    """Returns the serialized order with this id and its row_version if they are cached, else None"""
+    return order_cache.get(order_id) if trusted() else None
+
+
+def trusted() -> bool:
+    """Returns True if the cache is enabled and hears the writes of every worker"""
+    if not order_cache.enabled:
+        return False
+    listener.ensure_started()
+    return listener.connected.is_set()
+
+
+######################################################################
+#  L O C A L   I N V A L I D A T I O N
+######################################################################
+@event.listens_for(db.session, "after_flush")
+def collect_flushed_orders(session, flush_context):  # pylint: disable=unused-argument
+    """Records the orders whose rows, or whose items' rows, the flush wrote"""
+    changed = session.info.setdefault(CACHE_KEYS, set())
+    for record in list(session.new) + list(session.dirty) + list(session.deleted):
+        key = getattr(record, "CACHE_KEY", None)
+        if key is None:
+            continue
+        # Covers the current value as well as the one before a reassignment
+        history = db.inspect(record).attrs[key].history
+        changed.update(value for value in history.sum() if value is not None)
+
+
+@event.listens_for(db.session, "do_orm_execute")
+def collect_bulk_orders(execute_state):
+    """Treats bulk INSERT, UPDATE and DELETE statements as changing every order
+
+    Statements that record their own keys with invalidate_on_commit() opt
+    out with the cache_keys_marked execution option.
+    """
+    if (execute_state.is_insert or execute_state.is_update or execute_state.is_delete) and not (
+        execute_state.execution_options.get("cache_keys_marked")
+    ):
+        execute_state.session.info.setdefault(CACHE_KEYS, set()).add(ALL_KEYS)
+
+
+@event.listens_for(db.session, "after_commit")
+def invalidate_committed_orders(session):
+    """Drops the orders the committed transaction wrote"""
+    changed = session.info.pop(CACHE_KEYS, None)
+    if changed:
+        order_cache.invalidate(changed)
+
+
+@event.listens_for(db.session, "after_rollback")
+def forget_rolled_back_orders(session):
+    """Nothing was written, so nothing has to be invalidated"""
+    session.info.pop(CACHE_KEYS, None)
@@ -0,0 +1,128 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Query filter engine
+
+A FilterSet declares the query parameters a collection accepts, how each
+one is validated and which SQL criterion it turns into. Any combination
+of them is compiled into a single parameterized WHERE clause.
+"""
+
+import datetime
+from sqlalchemy import and_, true
+from .persistent_base import DataValidationError
+
+
+######################################################################
+#  P A R S E R S
+######################################################################
+def parse_date(value: str) -> datetime.date:
+    """Parses a date in YYYY-MM-DD format"""
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_datetime(value: str) -> datetime.datetime:
+    """Parses an ISO-8601 date or date and time, a date alone meaning midnight"""
+    return datetime.datetime.fromisoformat(value)
+
+
+def is_scalar_or_list(value) -> bool:
+    """Returns True for a JSON scalar or a list of them"""
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return all(not isinstance(item, (dict, list, tuple)) for item in values)
+
+
+######################################################################
+#  F I L T E R S
+######################################################################
+class Filter:  # pylint: disable=too-few-public-methods
+    """A query parameter that narrows a query"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, name: str, criterion, parse=str, *, many: bool = False, message: str = None):
+        """
+        Args:
+            name (str): the query parameter
+            criterion: callable that turns the parsed value into a SQL criterion
+            parse: callable that converts the raw string, raising ValueError if invalid
+            many (bool): accept several comma separated or repeated values
+            message (str): error message for invalid values, may use {name} and {value}
+        """
+        self.name = name
+        self.criterion = criterion
+        self.parse = parse
+        self.many = many
+        self.message = message or "Invalid {name}: '{value}'"
+
+    def values(self, args) -> list:
+        """Returns the non-empty raw values of this filter in args, a list in a JSON object giving several"""
+        if hasattr(args, "getlist"):
+            raw = args.getlist(self.name)
+        else:
+            raw = args.get(self.name)
+            raw = list(raw) if isinstance(raw, (list, tuple)) else [raw]
+        if self.many:
+            raw = [part for value in raw if value for part in str(value).split(",")]
+        return [str(value).strip() for value in raw if value not in (None, "")]
+
+    def compile(self, args):
+        """Returns the SQL criterion for this filter, or None if it was not given"""
+        values = self.values(args)
+        if not values:
+            return None
+        parsed = []
+        for value in values:
+            try:
+                parsed.append(self.parse(value))
+            except (TypeError, ValueError) as error:
+                raise DataValidationError(self.message.format(name=self.name, value=value)) from error
+        return self.criterion(parsed if self.many else parsed[-1])
+
+
+class FilterSet:
+    """The filters a collection endpoint accepts"""
+
+    def __init__(self, *filters: Filter):
+        self.filters = {f.name: f for f in filters}
+
+    @property
+    def names(self) -> list:
+        """Returns the names of the filters in declaration order"""
+        return list(self.filters)
+
+    def check_params(self, args, extra=()) -> None:
+        """Raises DataValidationError if args holds a parameter that is not a filter or in extra,
+        or, in a JSON object, a value that is neither a scalar nor a list of scalars"""
+        valid = self.names + list(extra)
+        for param in args:
+            if param not in valid:
+                raise DataValidationError(
+                    f"Invalid filter parameter: {param}. Valid filters are: {', '.join(valid)}"
+                )
+            if not hasattr(args, "getlist") and not is_scalar_or_list(args[param]):
+                raise DataValidationError(f"Invalid {param}: a filter takes a value or a list of values")
+
+    def where(self, args):
+        """Compiles every filter present in args into one criterion"""
+        criteria = [f.compile(args) for f in self.filters.values()]
+        criteria = [criterion for criterion in criteria if criterion is not None]
+        return and_(*criteria) if criteria else true()
+
+    def given(self, args) -> dict:
+        """Returns the filters present in args and their raw values, for logging"""
+        given = {name: f.values(args) for name, f in self.filters.items()}
+        return {name: values for name, values in given.items() if values}
@@ -0,0 +1,393 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Versioned schema migrations
+
+Every change to the database schema is appended to MIGRATIONS with the
+next version number and is never edited afterwards. upgrade() applies the
+versions that are missing from the schema_migrations table, and
+check_schema() compares a deployed database with the models.
+
+Migrations marked concurrent run outside of a transaction so that
+CREATE INDEX CONCURRENTLY can build indexes without locking out writes.
+"""
+
+import logging
+import re
+from sqlalchemy import inspect, text
+from .persistent_base import db
+
+logger = logging.getLogger("flask.app")
+
+# Arbitrary key for the advisory lock that serializes concurrent upgrades
+MIGRATION_LOCK_ID = 2820001
+
+INDEX_NAME = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.I)
+
+
+class Migration:  # pylint: disable=too-few-public-methods
+    """A single, numbered schema change"""
+
+    def __init__(self, version: int, description: str, statements: list, concurrent: bool = False):
+        self.version = version
+        self.description = description
+        self.statements = statements
+        self.concurrent = concurrent
+
+    def __repr__(self):
+        return f"<Migration version={self.version} {self.description!r}>"
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "Create the order and order_items tables",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS "order" (
+                id SERIAL NOT NULL,
+                customer_id INTEGER NOT NULL,
+                order_status VARCHAR(64) NOT NULL,
+                order_created TIMESTAMP WITHOUT TIME ZONE,
+                order_updated TIMESTAMP WITHOUT TIME ZONE,
+                PRIMARY KEY (id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS order_items (
+                id SERIAL NOT NULL,
+                order_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                price FLOAT NOT NULL,
+                PRIMARY KEY (id),
+                FOREIGN KEY(order_id) REFERENCES "order" (id) ON DELETE CASCADE
+            )
+            """,
+        ],
+    ),
+    Migration(
+        2,
+        "Index the order lookups, keyset sort keys and the order_items foreign key",
+        [
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_customer_id ON "order" (customer_id, id)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_order_status ON "order" (order_status, id)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_order_created ON "order" (order_created, id)',
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)",
+        ],
+        concurrent=True,
+    ),
+    Migration(
+        3,
+        "Index product searches within an order, replacing ix_order_items_order_id",
+        [
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_items_product_id ON order_items (order_id, product_id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_items_product_prefix "
+            "ON order_items (order_id, (product_id::text) text_pattern_ops)",
+            "DROP INDEX CONCURRENTLY IF EXISTS ix_order_items_order_id",
+        ],
+        concurrent=True,
+    ),
+    Migration(
+        4,
+        "Keep item_count and total_amount on order up to date with triggers on order_items",
+        [
+            'ALTER TABLE "order" ADD COLUMN IF NOT EXISTS item_count INTEGER NOT NULL DEFAULT 0',
+            'ALTER TABLE "order" ADD COLUMN IF NOT EXISTS total_amount DOUBLE PRECISION NOT NULL DEFAULT 0',
+            # Statement level triggers apply the change of a whole multi-row
+            # INSERT, UPDATE or DELETE with one UPDATE per direction. Adding
+            # deltas, instead of recounting, stays correct when concurrent
+            # writers of the same order queue up on its row lock.
+            """
+            CREATE OR REPLACE FUNCTION apply_order_item_totals() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    UPDATE "order" o
+                       SET item_count = o.item_count - d.items, total_amount = o.total_amount - d.amount
+                      FROM (SELECT order_id, count(*) AS items, sum(quantity * price) AS amount
+                              FROM old_rows GROUP BY order_id) d
+                     WHERE o.id = d.order_id;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    UPDATE "order" o
+                       SET item_count = o.item_count + d.items, total_amount = o.total_amount + d.amount
+                      FROM (SELECT order_id, count(*) AS items, sum(quantity * price) AS amount
+                              FROM new_rows GROUP BY order_id) d
+                     WHERE o.id = d.order_id;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            "DROP TRIGGER IF EXISTS order_items_totals_insert ON order_items",
+            "DROP TRIGGER IF EXISTS order_items_totals_update ON order_items",
+            "DROP TRIGGER IF EXISTS order_items_totals_delete ON order_items",
+            "CREATE TRIGGER order_items_totals_insert AFTER INSERT ON order_items "
+            "REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_order_item_totals()",
+            "CREATE TRIGGER order_items_totals_update AFTER UPDATE ON order_items "
+            "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+            "FOR EACH STATEMENT EXECUTE FUNCTION apply_order_item_totals()",
+            "CREATE TRIGGER order_items_totals_delete AFTER DELETE ON order_items "
+            "REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_order_item_totals()",
+            # Backfill, the ALTER TABLE lock keeps writers out until this commits
+            """
+            UPDATE "order" o
+               SET item_count = t.items, total_amount = t.amount
+              FROM (SELECT order_id, count(*) AS items, sum(quantity * price) AS amount
+                      FROM order_items GROUP BY order_id) t
+             WHERE o.id = t.order_id
+            """,
+        ],
+    ),
+    Migration(
+        5,
+        "Index the order totals for filtering and sorting",
+        [
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_total_amount ON "order" (total_amount, id)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_item_count ON "order" (item_count, id)',
+        ],
+        concurrent=True,
+    ),
+    Migration(
+        6,
+        "Announce changed orders on the order_cache channel for cache invalidation",
+        [
+            # One notification per statement with the ids it changed, or '*'
+            # when there are too many for the 8000 byte payload limit. Item
+            # changes are covered too, through the totals trigger's UPDATE.
+            """
+            CREATE OR REPLACE FUNCTION notify_order_cache() RETURNS trigger AS $$
+            DECLARE
+                ids TEXT;
+            BEGIN
+                SELECT CASE WHEN count(DISTINCT id) > 500 THEN '*' ELSE string_agg(DISTINCT id::text, ',') END
+                  INTO ids FROM changed_rows;
+                IF ids IS NOT NULL THEN
+                    PERFORM pg_notify('order_cache', ids);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            'DROP TRIGGER IF EXISTS order_cache_update ON "order"',
+            'DROP TRIGGER IF EXISTS order_cache_delete ON "order"',
+            'CREATE TRIGGER order_cache_update AFTER UPDATE ON "order" '
+            "REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_order_cache()",
+            'CREATE TRIGGER order_cache_delete AFTER DELETE ON "order" '
+            "REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_order_cache()",
+        ],
+    ),
+    Migration(
+        7,
+        "Version order rows for entity tags",
+        [
+            # A constant default does not rewrite the table
+            'ALTER TABLE "order" ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 1',
+            """
+            CREATE OR REPLACE FUNCTION bump_order_row_version() RETURNS trigger AS $$
+            BEGIN
+                NEW.row_version := OLD.row_version + 1;
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            'DROP TRIGGER IF EXISTS order_row_version ON "order"',
+            'CREATE TRIGGER order_row_version BEFORE UPDATE ON "order" '
+            "FOR EACH ROW EXECUTE FUNCTION bump_order_row_version()",
+        ],
+    ),
+    Migration(
+        8,
+        "Recount item_count and total_amount instead of adding deltas",
+        [
+            # Adding and subtracting float sums left rounding errors behind,
+            # an order whose items were all deleted could keep a total of
+            # 2.8e-17. The totals of the orders a statement touched are now
+            # counted again from their items. The orders are locked first,
+            # in id order, so that the recount runs with a snapshot taken
+            # after concurrent writers of the same orders committed.
+            "LOCK TABLE order_items IN SHARE MODE",
+            """
+            CREATE OR REPLACE FUNCTION apply_order_item_totals() RETURNS trigger AS $$
+            DECLARE
+                changed INTEGER[];
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    SELECT array_agg(DISTINCT order_id) INTO changed FROM new_rows;
+                ELSIF TG_OP = 'DELETE' THEN
+                    SELECT array_agg(DISTINCT order_id) INTO changed FROM old_rows;
+                ELSE
+                    SELECT array_agg(order_id) INTO changed
+                      FROM (SELECT order_id FROM old_rows UNION SELECT order_id FROM new_rows) r;
+                END IF;
+                PERFORM 1 FROM "order" WHERE id = ANY(changed) ORDER BY id FOR UPDATE;
+                UPDATE "order" o
+                   SET item_count = t.items, total_amount = t.amount
+                  FROM (SELECT c.id, count(i.id) AS items, coalesce(sum(i.quantity * i.price), 0) AS amount
+                          FROM unnest(changed) AS c(id) LEFT JOIN order_items i ON i.order_id = c.id
+                         GROUP BY c.id) t
+                 WHERE o.id = t.id;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            # Clear the errors the deltas already left, the SHARE lock keeps
+            # item writers out until this commits
+            """
+            UPDATE "order" o
+               SET item_count = t.items, total_amount = t.amount
+              FROM (SELECT r.id, count(i.id) AS items, coalesce(sum(i.quantity * i.price), 0) AS amount
+                      FROM "order" r LEFT JOIN order_items i ON i.order_id = r.id
+                     GROUP BY r.id) t
+             WHERE o.id = t.id AND (o.item_count, o.total_amount) IS DISTINCT FROM (t.items, t.amount)
+            """,
+        ],
+    ),
+]
+
+CREATE_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER NOT NULL PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()
+    )
+"""
+
+
+######################################################################
+#  M I G R A T I O N   R U N N E R
+######################################################################
+def latest_version() -> int:
+    """Returns the version the models expect the database to be at"""
+    return MIGRATIONS[-1].version
+
+
+def applied_versions(connection) -> set:
+    """Returns the set of versions recorded in schema_migrations"""
+    connection.execute(text(CREATE_VERSION_TABLE))
+    rows = connection.execute(text("SELECT version FROM schema_migrations"))
+    return {row.version for row in rows}
+
+
+def pending_migrations(engine) -> list:
+    """Returns the migrations that have not been applied yet, in order"""
+    with engine.begin() as connection:
+        applied = applied_versions(connection)
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+def _drop_invalid_index(connection, statement: str) -> None:
+    """Drops an INVALID index left behind by an interrupted concurrent build"""
+    match = INDEX_NAME.search(statement)
+    if not match:
+        return
+    invalid = connection.execute(
+        text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid AND pg_table_is_visible(c.oid)"
+        ),
+        {"name": match.group(1)},
+    ).first()
+    if invalid:
+        logger.warning("Dropping invalid index %s before rebuilding it", match.group(1))
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}"))
+
+
+def _apply(engine, lock_connection, migration: Migration) -> None:
+    """Applies a single migration and records it"""
+    logger.info("Applying migration %d: %s", migration.version, migration.description)
+    record = text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)")
+    params = {"version": migration.version, "description": migration.description}
+    if migration.concurrent:
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        for statement in migration.statements:
+            _drop_invalid_index(lock_connection, statement)
+            lock_connection.execute(text(statement))
+        lock_connection.execute(record, params)
+        return
+    with engine.begin() as connection:
+        for statement in migration.statements:
+            connection.execute(text(statement))
+        connection.execute(record, params)
+
+
+def upgrade(engine, target: int = None) -> list:
+    """
+    Brings the database up to ``target`` (default: the latest version)
+
+    A PostgreSQL advisory lock makes concurrent callers, such as several
+    pods starting at once, wait for each other instead of racing.
+
+    Returns:
+        the list of migrations that were applied
+    """
+    target = target or latest_version()
+    applied = []
+    with engine.connect() as lock_connection:
+        lock_connection = lock_connection.execution_options(isolation_level="AUTOCOMMIT")
+        lock_connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            done = applied_versions(lock_connection)
+            for migration in MIGRATIONS:
+                if migration.version in done or migration.version > target:
+                    continue
+                _apply(engine, lock_connection, migration)
+                applied.append(migration)
+        finally:
+            lock_connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+    if applied:
+        logger.info("Database schema upgraded to version %d", applied[-1].version)
+    return applied
+
+
+######################################################################
+#  S C H E M A   D R I F T   C H E C K
+######################################################################
+def check_schema(engine, metadata=None) -> list:
+    """
+    Compares the deployed schema with the models
+
+    Returns:
+        a list of human readable differences, empty when they match
+    """
+    metadata = metadata or db.metadata
+    inspector = inspect(engine)
+    problems = []
+    existing_tables = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            problems.append(f"missing table {table.name}")
+            continue
+        columns = {column["name"]: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                problems.append(f"missing column {table.name}.{column.name}")
+            elif columns[column.name]["nullable"] != column.nullable:
+                problems.append(f"column {table.name}.{column.name} nullable should be {column.nullable}")
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                problems.append(f"missing index {index.name} on {table.name}")
+    with engine.connect() as connection:
+        invalid = connection.execute(
+            text(
+                "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE NOT i.indisvalid AND pg_table_is_visible(c.oid)"
+            )
+        )
+        problems.extend(f"invalid index {row.relname}" for row in invalid)
+    return problems
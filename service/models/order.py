@@ -19,23 +19,68 @@ Persistent Base class for database CRUD functions
 """
 
 import logging
-
-# from datetime import date
+import datetime
+import functools
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import and_, false, update
 from sqlalchemy.exc import SQLAlchemyError
-from .persistent_base import db, PersistentBase, DataValidationError
-from .orderitems import OrderItems
+from sqlalchemy.orm import joinedload, lazyload, load_only, noload, raiseload, selectinload, subqueryload
+from sqlalchemy.orm.attributes import set_committed_value
+from service.common.tracing import traced
+from .persistent_base import db, PersistentBase, DataValidationError, invalidate_on_commit
+from .orderitems import OrderItems, ITEM_SERIALIZER
+from .filters import Filter, FilterSet, parse_date, parse_datetime
+from .serializers import ModelSerializer
 
 logger = logging.getLogger("flask.app")
 
+# Ways of loading Order.orderitems, selected with ORDERITEMS_LOADING or per call
+LOADING_STRATEGIES = {
+    "select": lazyload,  # one SELECT per order when orderitems is first touched
+    "selectin": selectinload,  # one batched SELECT ... WHERE order_id IN (...)
+    "joined": joinedload,  # LEFT OUTER JOIN in the same statement
+    "subquery": subqueryload,  # second SELECT that re-runs the query as a subquery
+    "raise": raiseload,  # never load, raise if orderitems is accessed
+    "noload": noload,  # never load, orderitems is always empty
+}
+
 
 ######################################################################
 #  ORDER   M O D E L
 ######################################################################
-class Order(db.Model, PersistentBase):
+class Order(db.Model, PersistentBase):  # pylint: disable=too-many-public-methods
     """
     Class that represents an Order
     """
 
+    # Secondary indexes, created by migration 2 (see service.models.migrations)
+    __table_args__ = (
+        db.Index("ix_order_customer_id", "customer_id", "id"),
+        db.Index("ix_order_order_status", "order_status", "id"),
+        db.Index("ix_order_order_created", "order_created", "id"),
+        # created by migration 5
+        db.Index("ix_order_total_amount", "total_amount", "id"),
+        db.Index("ix_order_item_count", "item_count", "id"),
+    )
+
+    # Columns that list_orders can sort (and page) by
+    SORTABLE = (
+        "id", "customer_id", "order_status", "order_created", "order_updated", "item_count", "total_amount"
+    )
+
+    # Statuses an order may be moved to, and the statuses (compared in lower
+    # case) it has to be in for that
+    TRANSITIONS = {
+        "received": ("pending",),
+        "shipped": ("pending", "received"),
+        "delivered": ("shipped",),
+        "canceled": ("pending",),
+    }
+
+    # Orders are cached by id, see service.models.cache
+    CACHE_KEY = "id"
+
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, nullable=False)
@@ -46,24 +91,28 @@ class Order(db.Model, PersistentBase):
     order_updated = db.Column(
         db.DateTime, nullable=True, default=db.func.current_timestamp()
     )
-    orderitems = db.relationship("OrderItems", backref="order", passive_deletes=True)
+    # Maintained by triggers on order_items (migration 4), never written here
+    item_count = db.Column(db.Integer, nullable=False, server_default="0")
+    total_amount = db.Column(db.Float, nullable=False, server_default="0")
+    # Bumped by a trigger on every UPDATE of the row (migration 7), which
+    # the totals trigger also issues when the order's items change
+    row_version = db.Column(db.BigInteger, nullable=False, server_default="1")
+    orderitems = db.relationship(
+        "OrderItems", backref="order", passive_deletes=True, lazy="select", order_by="OrderItems.id"
+    )
 
     def __repr__(self):
         return f"<Order id={self.id}>"
 
     def serialize(self):
         """Converts an Order into a dictionary"""
-        order = {
-            "id": self.id,
-            "customer_id": self.customer_id,
-            "order_status": self.order_status,
-            "order_created": self.order_created,
-            "order_updated": self.order_updated,
-            "orderitems": [],
-        }
+        return ORDER_SERIALIZER(self)
+
+    def reset_ids(self) -> None:
+        """Clears the primary keys of the order and its items"""
+        super().reset_ids()
         for item in self.orderitems:
-            order["orderitems"].append(item.serialize())
-        return order
+            item.reset_ids()
 
     def deserialize(self, data):
         """
@@ -97,48 +146,283 @@ class Order(db.Model, PersistentBase):
         return self
 
     @classmethod
-    def find_by_customer(cls, customer_id):
-        """Returns all orders from the database with the given customer_id
+    def loader_options(cls, loading: str = None) -> list:
+        """Returns the options that load orderitems with the given strategy
 
         Args:
-            customer_id (int): the customer_id of the orders to find
+            loading (str): a key of LOADING_STRATEGIES, defaults to ORDERITEMS_LOADING
+        """
+        loading = loading or current_app.config.get("ORDERITEMS_LOADING", "selectin")
+        try:
+            strategy = LOADING_STRATEGIES[loading]
+        except KeyError as error:
+            raise DataValidationError(
+                f"Invalid loading strategy: {loading}. Valid strategies are: {', '.join(LOADING_STRATEGIES)}"
+            ) from error
+        return [strategy(cls.orderitems)]
+
+    @classmethod
+    def fieldset(cls, fields: str = None, include: str = None) -> tuple:
+        """Parses the fields and include query parameters of an order read
+
+        Args:
+            fields (str): comma separated columns to return, id is always returned
+            include (str): comma separated relationships to add, only orderitems
 
         Returns:
-            a list of Order objects. Could be empty.
+            a tuple of (columns, with_items). columns is None when fields was
+            not given, which means every column and the items.
+        """
+        included = {name.strip() for name in (include or "").split(",") if name.strip()}
+        if included - {"orderitems"}:
+            raise DataValidationError(
+                f"Invalid include: '{include}'. Only orderitems can be included."
+            )
+        if not fields:
+            return None, True
+        requested = {name.strip() for name in fields.split(",") if name.strip()}
+        unknown = requested - set(ORDER_SERIALIZER.fields)
+        if unknown:
+            raise DataValidationError(
+                f"Invalid fields: {', '.join(sorted(unknown))}. Valid fields are: {', '.join(ORDER_SERIALIZER.fields)}"
+            )
+        columns = tuple(name for name in ORDER_SERIALIZER.fields if name in requested or name == "id")
+        return columns, "orderitems" in included
+
+    @classmethod
+    def column_options(cls, columns: tuple, *extra: str) -> list:
+        """Returns the options that load only columns, plus those of extra that are columns
+
+        Args:
+            columns (tuple): the columns to load, None for all of them
+            extra (str): names the caller needs as well, such as the sort key
+        """
+        if columns is None:
+            return []
+        names = dict.fromkeys(columns + tuple(name for name in extra if name in cls.__table__.c))
+        return [load_only(*(getattr(cls, name) for name in names))]
+
+    @classmethod
+    @traced
+    def find_fields(cls, order_id: int, columns: tuple, with_items: bool):
+        """Finds an order selecting only columns, and its items only if with_items"""
+        options = cls.column_options(columns) + cls.loader_options(None if with_items else "noload")
+        return db.session.get(cls, order_id, options=options)
+
+    @classmethod
+    def customer_filter(cls, customer_id):
+        """Returns the SQL criterion that matches orders for the given customer_id
+
+        Args:
+            customer_id (int): the customer_id of the orders to match
+
+        Returns:
+            a SQLAlchemy criterion that matches nothing if customer_id is not a number
         """
         try:
             # Convert string to int if it's a string
             if isinstance(customer_id, str):
                 customer_id = int(customer_id)
-            return cls.query.filter(cls.customer_id == customer_id).all()
+            return cls.customer_id == customer_id
         except (ValueError, TypeError):
-            # Return empty list if conversion fails
-            return []
+            return false()
+
+    @classmethod
+    def status_filter(cls, status):
+        """Returns the SQL criterion that matches orders with the given status
+
+        Args:
+            status (string or list): the status, or a list of statuses any of which may match
+        """
+        if isinstance(status, (list, tuple)):
+            return cls.order_status.in_(status)
+        return cls.order_status == status
+
+    @classmethod
+    def date_filter(cls, date_str):
+        """Returns the SQL criterion that matches orders created on the given date
+
+        Args:
+            date_str (string): the date of the orders to match in format YYYY-MM-DD
+        """
+        # Compare order_created with the range [date, date + 1 day) rather than
+        # taking its date part, so the ix_order_order_created index can be used
+        day = db.func.cast(date_str, db.Date)
+        return and_(
+            cls.order_created >= day,
+            cls.order_created < day + datetime.timedelta(days=1),
+        )
+
+    @classmethod
+    def created_after_filter(cls, moment):
+        """Returns the SQL criterion that matches orders created at or after moment"""
+        return cls.order_created >= moment
 
     @classmethod
-    def find_by_status(cls, status):
+    def created_before_filter(cls, moment):
+        """Returns the SQL criterion that matches orders created before moment"""
+        return cls.order_created < moment
+
+    @classmethod
+    def version(cls, order_id: int):
+        """Returns the row_version of an order, or None if it does not exist"""
+        return db.session.scalar(db.select(cls.row_version).where(cls.id == order_id))
+
+    @classmethod
+    def items_with_version(cls, order_id: int, *criteria) -> tuple:
+        """Returns the row_version of an order and its items that match criteria
+
+        Both come from one query, the order LEFT JOINed with its matching items.
+
+        Returns:
+            a tuple of (row_version, items), row_version being None if the
+            order does not exist
+        """
+        rows = (
+            db.session.query(cls.row_version, OrderItems)
+            .select_from(cls)
+            .outerjoin(OrderItems, and_(OrderItems.order_id == cls.id, *criteria))
+            .filter(cls.id == order_id)
+            .order_by(OrderItems.id)
+            .all()
+        )
+        if not rows:
+            return None, []
+        return rows[0][0], [item for _, item in rows if item is not None]
+
+    @classmethod
+    def touch(cls, order_id: int) -> None:
+        """Sets order_updated to now as part of the current transaction, without loading the order"""
+        db.session.execute(
+            update(cls)
+            .where(cls.id == order_id)
+            .values(order_updated=datetime.datetime.now())
+            .execution_options(cache_keys_marked=True)
+        )
+        invalidate_on_commit({order_id})
+
+    @classmethod
+    def transition(cls, criterion, target: str, chunk_size: int = 1000) -> tuple:
+        """Moves every order that matches criterion to the target status
+
+        Args:
+            criterion: SQL criterion selecting the orders, see ORDER_FILTERS
+            target (str): the new status, a key of TRANSITIONS
+            chunk_size (int): how many orders to update per transaction
+
+        Returns:
+            a tuple of (transitioned, skipped) counts, skipped being the matching
+            orders that were not in one of the allowed source statuses
+
+        Each chunk is one UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP
+        LOCKED) RETURNING id committed on its own, so row locks are only held
+        for one chunk and orders locked by another request are left alone.
+        """
+        target = str(target).lower()
+        if target not in cls.TRANSITIONS:
+            raise DataValidationError(
+                f"Invalid status: '{target}'. Orders can be moved to: {', '.join(cls.TRANSITIONS)}"
+            )
+        matched = db.session.query(db.func.count(cls.id)).filter(criterion).scalar()
+        chunk = (
+            db.select(cls.id)
+            .where(criterion, db.func.lower(cls.order_status).in_(cls.TRANSITIONS[target]))
+            .order_by(cls.id)
+            .limit(chunk_size)
+            .with_for_update(skip_locked=True)
+        )
+        statement = (
+            update(cls)
+            .where(cls.id.in_(chunk.scalar_subquery()))
+            .values(order_status=target, order_updated=datetime.datetime.now())
+            .returning(cls.id)
+            .execution_options(synchronize_session=False, cache_keys_marked=True)
+        )
+        transitioned = 0
+        while True:
+            ids = db.session.scalars(statement).all()
+            invalidate_on_commit(ids)
+            db.session.commit()
+            transitioned += len(ids)
+            logger.info("Moved %d orders to %s", len(ids), target)
+            if len(ids) < chunk_size:
+                break
+        return transitioned, max(matched - transitioned, 0)
+
+    @classmethod
+    @traced
+    def find_by_customer(cls, customer_id, loading: str = None):
+        """Returns all orders from the database with the given customer_id
+
+        Args:
+            customer_id (int): the customer_id of the orders to find
+            loading (str): how to load the orderitems, see loader_options()
+
+        Returns:
+            a list of Order objects. Could be empty.
+        """
+        query = cls.query.options(*cls.loader_options(loading))
+        return query.filter(cls.customer_filter(customer_id)).all()
+
+    @classmethod
+    def customer_summary(cls, customer_id) -> dict:
+        """Returns order statistics for a customer from one grouped query
+
+        Args:
+            customer_id (int): the customer to summarize
+
+        Returns:
+            a dictionary with the order and item counts, the total spent, the
+            date of the last order and the number of orders per status
+        """
+        rows = (
+            db.session.query(
+                cls.order_status,
+                db.func.count(cls.id),
+                db.func.sum(cls.item_count),
+                db.func.sum(cls.total_amount),
+                db.func.max(cls.order_created),
+            )
+            .filter(cls.customer_filter(customer_id))
+            .group_by(cls.order_status)
+            .all()
+        )
+        created = [row[4] for row in rows if row[4] is not None]
+        return {
+            "customer_id": customer_id,
+            "order_count": sum(row[1] for row in rows),
+            "item_count": sum(row[2] for row in rows),
+            "total_spent": round(sum(row[3] for row in rows), 2),
+            "last_order_date": max(created) if created else None,
+            "orders_by_status": {row[0]: row[1] for row in rows},
+        }
+
+    @classmethod
+    @traced
+    def find_by_status(cls, status, loading: str = None):
         """Returns all orders from the database with the given status
         Args:
             status (string): the status of the orders to find
+            loading (str): how to load the orderitems, see loader_options()
         Returns:
             a list of Order objects. Could be empty.
         """
-        return cls.query.filter(cls.order_status == status).all()
+        query = cls.query.options(*cls.loader_options(loading))
+        return query.filter(cls.status_filter(status)).all()
 
     @classmethod
-    def find_by_date(cls, date_str):
+    @traced
+    def find_by_date(cls, date_str, loading: str = None):
         """Returns all orders from the database created on the given date
         Args:
             date_str (string): the date of the orders to find in format YYYY-MM-DD
+            loading (str): how to load the orderitems, see loader_options()
         Returns:
             a list of Order objects. Could be empty.
         """
+        query = cls.query.options(*cls.loader_options(loading))
         try:
-            # Use SQLAlchemy's cast function to convert the date string to a date
-            # and compare with the date part of order_created
-            return cls.query.filter(
-                db.func.date(cls.order_created) == db.func.cast(date_str, db.Date)
-            ).all()
+            return query.filter(cls.date_filter(date_str)).all()
         except (ValueError, TypeError):
             # Return empty list if there's an error with the date format
             return []
@@ -146,3 +430,102 @@ class Order(db.Model, PersistentBase):
             # Return empty list if there's a database error
             logger.error("Database error occurred when finding orders by date")
             return []
+
+    @classmethod
+    def stream(cls, query, batch_size: int, with_items: bool = True):
+        """Yields the orders of a query from a server-side cursor with their items
+        Args:
+            query: the query for the orders, without loader options
+            batch_size (int): how many orders to fetch per round trip
+            with_items (bool): False to leave the items out
+        Yields:
+            Order objects, batch_size of them in memory at a time
+
+        selectinload cannot be combined with yield_per, so the items of each
+        batch are read with one IN query and attached to their orders.
+        """
+        statement = query.options(noload(cls.orderitems)).statement
+        result = db.session.scalars(statement.execution_options(yield_per=batch_size))
+        for orders in result.partitions():
+            if with_items:
+                cls.load_items(orders)
+            yield from orders
+
+    @classmethod
+    def load_items(cls, orders: list) -> None:
+        """Reads the items of orders loaded without them with one IN query"""
+        items = defaultdict(list)
+        ids = [order.id for order in orders]
+        if ids:
+            for item in OrderItems.query.filter(OrderItems.order_id.in_(ids)).order_by(OrderItems.id):
+                items[item.order_id].append(item)
+        for order in orders:
+            set_committed_value(order, "orderitems", items[order.id])
+
+
+# Every column of Order, in declaration order, followed by its items. The
+# row_version only identifies a representation (see service.common.conditional)
+# and is left out of it, read it with Order.version() instead.
+ORDER_SERIALIZER = ModelSerializer(Order, nested={"orderitems": ITEM_SERIALIZER}, exclude=("row_version",))
+
+
+@functools.lru_cache(maxsize=64)
+def order_serializer(columns: tuple = None, with_items: bool = True) -> ModelSerializer:
+    """Returns the serializer for a fieldset parsed by Order.fieldset()"""
+    if columns is None:
+        return ORDER_SERIALIZER
+    return ModelSerializer(Order, nested={"orderitems": ITEM_SERIALIZER} if with_items else None, only=columns)
+
+
+# Query parameters accepted by list_orders, see service.models.filters
+ORDER_FILTERS = FilterSet(
+    Filter(
+        "customer",
+        Order.customer_filter,
+        parse=int,
+        message="Invalid customer: '{value}'. Customer must be an integer.",
+    ),
+    Filter("status", Order.status_filter, many=True),
+    Filter(
+        "date",
+        Order.date_filter,
+        parse=parse_date,
+        message="Invalid date format. Date must be in YYYY-MM-DD format.",
+    ),
+    Filter(
+        "created_after",
+        Order.created_after_filter,
+        parse=parse_datetime,
+        message="Invalid {name}: '{value}'. It must be an ISO-8601 date or date and time.",
+    ),
+    Filter(
+        "created_before",
+        Order.created_before_filter,
+        parse=parse_datetime,
+        message="Invalid {name}: '{value}'. It must be an ISO-8601 date or date and time.",
+    ),
+    Filter(
+        "min_total",
+        lambda total: Order.total_amount >= total,
+        parse=float,
+        message="Invalid min_total: '{value}'. Total must be a number.",
+    ),
+    Filter(
+        "max_total",
+        lambda total: Order.total_amount <= total,
+        parse=float,
+        message="Invalid max_total: '{value}'. Total must be a number.",
+    ),
+    Filter(
+        "min_items",
+        lambda count: Order.item_count >= count,
+        parse=int,
+        message="Invalid min_items: '{value}'. Item count must be an integer.",
+    ),
+    Filter(
+        "max_items",
+        lambda count: Order.item_count <= count,
+        parse=int,
+        message="Invalid max_items: '{value}'. Item count must be an integer.",
+    ),
+)
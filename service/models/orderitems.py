@@ -19,7 +19,10 @@ Persistent Base class for database CRUD functions
 """
 
 import logging
+from service.common.tracing import traced
 from .persistent_base import db, PersistentBase, DataValidationError
+from .filters import Filter, FilterSet
+from .serializers import ModelSerializer
 
 logger = logging.getLogger("flask.app")
 
@@ -41,6 +44,21 @@ class OrderItems(db.Model, PersistentBase):
     quantity: int = db.Column(db.Integer, nullable=False)
     price: float = db.Column(db.Float, nullable=False)
 
+    # Secondary indexes, created by migration 3 (see service.models.migrations).
+    # Both lead with order_id so they also serve the foreign key and its cascade.
+    __table_args__ = (
+        db.Index("ix_order_items_product_id", order_id, product_id),
+        db.Index(
+            "ix_order_items_product_prefix",
+            order_id,
+            db.cast(product_id, db.Text).label("product_text"),
+            postgresql_ops={"product_text": "text_pattern_ops"},
+        ),
+    )
+
+    # Items are cached as part of their order, see service.models.cache
+    CACHE_KEY = "order_id"
+
     def __repr__(self):
         return f"<Item id=[{self.id}] order[{self.order_id}]>"
 
@@ -49,13 +67,7 @@ class OrderItems(db.Model, PersistentBase):
 
     def serialize(self) -> dict:
         """Converts an Item into a dictionary"""
-        return {
-            "id": self.id,
-            "order_id": self.order_id,
-            "product_id": self.product_id,
-            "quantity": self.quantity,
-            "price": self.price,
-        }
+        return ITEM_SERIALIZER(self)
 
     def deserialize(self, data: dict) -> None:
         """
@@ -82,17 +94,74 @@ class OrderItems(db.Model, PersistentBase):
 
         return self
 
+    @classmethod
+    def product_prefix_filter(cls, prefix: str):
+        """Returns the SQL criterion that matches items whose product_id starts with prefix"""
+        return db.cast(cls.product_id, db.Text).startswith(prefix, autoescape=True)
+
     # code juan we are creating a new class method to list items in an order
 
     @classmethod
-    def find_by_order_id(cls, order_id: int):
+    @traced
+    def find_in_order(cls, order_id: int, item_id: int):
+        """Finds an item by id, but only if it belongs to the given order"""
+        return cls.query.filter_by(id=item_id, order_id=order_id).first()
+
+    @classmethod
+    def order_query(cls, order_id: int, *criteria):
+        """Returns the query for the items of an order that match the criteria, by id"""
+        return cls.query.filter_by(order_id=order_id).filter(*criteria).order_by(cls.id)
+
+    @classmethod
+    @traced
+    def find_by_order_id(cls, order_id: int, *criteria):
         """
         Finds all items in an order by order id
 
         Args:
             order_id (int): the order id to search for
+            criteria: optional SQL criteria the items must also match
 
         Returns:
             list: a list of Item objects
         """
-        return cls.query.filter_by(order_id=order_id).all()
+        return cls.order_query(order_id, *criteria).all()
+
+
+# Every column of OrderItems, in declaration order
+ITEM_SERIALIZER = ModelSerializer(OrderItems)
+
+# Query parameters accepted by list_orderitems, see service.models.filters
+ITEM_FILTERS = FilterSet(
+    Filter("search", OrderItems.product_prefix_filter),
+    Filter(
+        "product_id",
+        lambda product_id: OrderItems.product_id == product_id,
+        parse=int,
+        message="Invalid product_id: '{value}'. Product id must be an integer.",
+    ),
+    Filter(
+        "min_quantity",
+        lambda quantity: OrderItems.quantity >= quantity,
+        parse=int,
+        message="Invalid min_quantity: '{value}'. Quantity must be an integer.",
+    ),
+    Filter(
+        "max_quantity",
+        lambda quantity: OrderItems.quantity <= quantity,
+        parse=int,
+        message="Invalid max_quantity: '{value}'. Quantity must be an integer.",
+    ),
+    Filter(
+        "min_price",
+        lambda price: OrderItems.price >= price,
+        parse=float,
+        message="Invalid min_price: '{value}'. Price must be a number.",
+    ),
+    Filter(
+        "max_price",
+        lambda price: OrderItems.price <= price,
+        parse=float,
+        message="Invalid max_price: '{value}'. Price must be a number.",
+    ),
+)
@@ -0,0 +1,192 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Keyset (cursor) pagination
+
+Pages are addressed by the sort key and id of the last row that was
+returned instead of by an OFFSET, so the database can seek straight to
+the next page through the (sort key, id) index and page N costs the same
+as page 1.
+"""
+
+import base64
+import binascii
+import datetime
+import json
+import logging
+from sqlalchemy import and_, or_, tuple_
+from .persistent_base import DataValidationError
+
+logger = logging.getLogger("flask.app")
+
+
+class Page:  # pylint: disable=too-few-public-methods
+    """A single page of results plus the cursor for the one after it"""
+
+    def __init__(self, items: list, next_cursor: str = None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+
+def parse_limit(value, default: int, maximum: int) -> int:
+    """
+    Converts the ``limit`` query parameter into a page size
+
+    Missing values fall back to ``default`` and anything above ``maximum``
+    is capped so a client can never ask for an unbounded page.
+    """
+    if value is None or value == "":
+        return min(default, maximum)
+    try:
+        limit = int(value)
+    except (TypeError, ValueError) as error:
+        raise DataValidationError(
+            f"Invalid limit: '{value}'. Limit must be a positive integer."
+        ) from error
+    if limit < 1:
+        raise DataValidationError(
+            f"Invalid limit: '{value}'. Limit must be a positive integer."
+        )
+    return min(limit, maximum)
+
+
+def parse_sort(model, sort: str):
+    """
+    Converts a sort specification like ``-order_created`` into a column
+
+    Args:
+        model: the model class, which lists its sortable columns in SORTABLE
+        sort (str): a column name, optionally prefixed with '-' for descending
+
+    Returns:
+        a tuple of (column, descending)
+    """
+    descending = sort.startswith("-")
+    name = sort[1:] if descending else sort
+    if name not in model.SORTABLE:
+        raise DataValidationError(
+            f"Invalid sort: '{sort}'. Valid sort keys are: {', '.join(model.SORTABLE)}"
+        )
+    return getattr(model, name), descending
+
+
+def encode_cursor(sort: str, value, last_id: int) -> str:
+    """Builds the opaque cursor that points just past (value, last_id)"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat()
+    payload = json.dumps({"s": sort, "v": value, "id": last_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, column):
+    """
+    Unpacks a cursor created by encode_cursor
+
+    Returns:
+        a tuple of (value, last_id) with the value converted back to the
+        python type of the sort column
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        value, last_id = payload["v"], int(payload["id"])
+        cursor_sort = payload["s"]
+        if value is not None and column.type.python_type is datetime.datetime:
+            value = datetime.datetime.fromisoformat(value)
+        elif value is not None:
+            value = column.type.python_type(value)
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError) as error:
+        raise DataValidationError(f"Invalid cursor: '{cursor}'") from error
+    if cursor_sort != sort:
+        raise DataValidationError(
+            f"Invalid cursor: it was issued for sort '{cursor_sort}', not '{sort}'"
+        )
+    return value, last_id
+
+
+def _seek(column, id_column, descending: bool, value, last_id: int):
+    """
+    Returns the criterion selecting the rows that follow (value, last_id)
+
+    PostgreSQL sorts NULLs last in ascending order and first in descending
+    order, so nullable sort columns need an explicit branch for them.
+    """
+    if column is id_column:
+        return id_column < last_id if descending else id_column > last_id
+    if descending:
+        if value is None:
+            return or_(and_(column.is_(None), id_column < last_id), column.is_not(None))
+        return tuple_(column, id_column) < tuple_(value, last_id)
+    if value is None:
+        return and_(column.is_(None), id_column > last_id)
+    after = tuple_(column, id_column) > tuple_(value, last_id)
+    return or_(after, column.is_(None)) if column.expression.nullable else after
+
+
+def keyset_query(query, model, sort: str = "id", cursor: str = None):
+    """
+    Orders ``query`` by ``sort`` with id as tie-breaker and seeks past ``cursor``
+
+    Args:
+        query: the (already filtered) query to page through
+        model: the model class being queried
+        sort (str): the sort specification, see parse_sort()
+        cursor (str): the cursor returned with the previous page, if any
+
+    Returns:
+        the ordered query, without a LIMIT
+    """
+    column, descending = parse_sort(model, sort)
+    id_column = model.id
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort, column)
+        query = query.filter(_seek(column, id_column, descending, value, last_id))
+
+    if column is id_column:
+        order_by = [id_column.desc() if descending else id_column.asc()]
+    elif descending:
+        order_by = [column.desc(), id_column.desc()]
+    else:
+        order_by = [column.asc(), id_column.asc()]
+    return query.order_by(*order_by)
+
+
+def paginate(query, model, sort: str = "id", limit: int = 100, cursor: str = None) -> Page:
+    """
+    Fetches one page of ``query`` ordered by ``sort`` with id as tie-breaker
+
+    Args:
+        query: the (already filtered) query to page through
+        model: the model class being queried
+        sort (str): the sort specification, see parse_sort()
+        limit (int): the maximum number of rows to return
+        cursor (str): the cursor returned with the previous page, if any
+
+    Returns:
+        a Page holding the rows and the cursor for the next page (None when
+        this is the last page)
+    """
+    # Fetch one extra row to find out if there is another page
+    rows = keyset_query(query, model, sort, cursor).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return Page(rows)
+
+    rows = rows[:limit]
+    last = rows[-1]
+    logger.info("Page of %d rows ends at id %s", limit, last.id)
+    column, _ = parse_sort(model, sort)
+    return Page(rows, encode_cursor(sort, getattr(last, column.key), last.id))
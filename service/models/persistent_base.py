@@ -20,23 +20,75 @@ Persistent Base class for database CRUD functions
 
 import logging
 from abc import abstractmethod
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import DataError, IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import raiseload
+from service.common.tracing import traced
+from .replicas import RoutingSession
 
 logger = logging.getLogger("flask.app")
 
-db = SQLAlchemy()
+# Reads of GET requests may go to a replica, see service.models.replicas
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+# Session.info key that collects the cache keys written by the current
+# transaction, and the key standing for all of them (see service.models.cache)
+CACHE_KEYS = "cache_keys"
+ALL_KEYS = "*"
 
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+def invalidate_on_commit(keys) -> None:
+    """Records cache keys to drop once the current transaction commits
+
+    Bulk statements that do this themselves are executed with the
+    cache_keys_marked option, every other one invalidates the whole cache.
+    """
+    db.session.info.setdefault(CACHE_KEYS, set()).update(keys)
+
+
+@event.listens_for(db.session, "do_orm_execute")
+def raise_on_lazy_load(execute_state):
+    """
+    Makes relationships that were not eagerly loaded raise instead of lazy loading
+
+    Only active when RAISE_ON_LAZY_LOAD is set, which is meant for development
+    and tests so that N+1 query patterns fail loudly instead of slowly.
+    """
+    if (
+        execute_state.is_select
+        and not execute_state.is_column_load
+        and not execute_state.is_relationship_load
+        and has_app_context()
+        and current_app.config.get("RAISE_ON_LAZY_LOAD")
+    ):
+        execute_state.statement = execute_state.statement.options(
+            raiseload("*", sql_only=True)
+        )
+
+
+def rejection(name: str, error: SQLAlchemyError) -> str:
+    """Returns the message to give a client for a record the database rejected"""
+    if isinstance(error, IntegrityError):
+        return f"Invalid {name}: it violates a constraint of the database"
+    return f"Invalid {name}: a value is out of range or of the wrong type"
+
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
 class PersistentBase:
     """Base class added persistent methods"""
 
+    # Attribute holding the key of the cached order a record belongs to
+    CACHE_KEY = None
+
     def __init__(self):
         self.id = None  # pylint: disable=invalid-name
 
@@ -48,6 +100,7 @@ class PersistentBase:
     def deserialize(self, data: dict) -> None:
         """Convert a dictionary into an object"""
 
+    @traced
     def create(self) -> None:
         """
         Creates a Account to the database
@@ -63,6 +116,59 @@ class PersistentBase:
             logger.error("Error creating record: %s", self)
             raise DataValidationError(e) from e
 
+    @classmethod
+    @traced
+    def create_many(cls, records: list) -> list:
+        """
+        Creates several records in a single transaction
+
+        The unit of work sends each table as one multi-row INSERT ... RETURNING.
+        If the database rejects that, every record is retried in its own
+        savepoint so that one bad record does not fail the others.
+
+        Returns:
+            a list with None for each record that was created, or the error
+            message of the record that failed, in the same order as records.
+            The messages do not repeat what the database said, which names
+            its statements and parameters, that only goes to the log.
+        """
+        logger.info("Creating %d records", len(records))
+        try:
+            db.session.add_all(records)
+            db.session.commit()
+            cls.reload(records)
+            return [None] * len(records)
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            logger.warning("Batch insert failed, retrying record by record: %s", error)
+
+        errors = []
+        for record in records:
+            record.reset_ids()
+            try:
+                with db.session.begin_nested():
+                    db.session.add(record)
+            except (IntegrityError, DataError) as error:
+                logger.error("Error creating record %s: %s", record, error.orig)
+                errors.append(rejection(cls.__name__, error))
+            else:
+                errors.append(None)
+        db.session.commit()
+        cls.reload([record for record, error in zip(records, errors) if error is None])
+        return errors
+
+    @classmethod
+    def reload(cls, records: list) -> None:
+        """Refreshes records expired by a commit with one query instead of one per record"""
+        ids = [inspect(record).identity[0] for record in records]
+        if ids:
+            cls.query.options(*cls.loader_options()).filter(cls.id.in_(ids)).all()
+
+    def reset_ids(self) -> None:
+        """Clears the primary keys a failed flush may have assigned"""
+        self.id = None
+
+    @traced
     def update(self) -> None:
         """
         Updates a Account to the database
@@ -77,6 +183,7 @@ class PersistentBase:
             logger.error("Error updating record: %s", self)
             raise DataValidationError(e) from e
 
+    @traced
     def delete(self) -> None:
         """Removes a Account from the data store"""
         logger.info("Deleting %s", self)
@@ -89,15 +196,57 @@ class PersistentBase:
             raise DataValidationError(e) from e
 
     @classmethod
-    def all(cls):
+    def loader_options(cls, loading: str = None) -> list:  # pylint: disable=unused-argument
+        """Returns the relationship loader options to apply to queries"""
+        return []
+
+    @classmethod
+    @traced
+    def all(cls, loading: str = None):
         """Returns all of the records in the database"""
         logger.info("Processing all records")
         # pylint: disable=no-member
-        return cls.query.all()
+        return cls.query.options(*cls.loader_options(loading)).all()
 
     @classmethod
-    def find(cls, by_id):
+    @traced
+    def find(cls, by_id, loading: str = None):
         """Finds a record by it's ID"""
         logger.info("Processing lookup for id %s ...", by_id)
         # pylint: disable=no-member
-        return cls.query.session.get(cls, by_id)
+        return cls.query.session.get(cls, by_id, options=cls.loader_options(loading))
+
+    @classmethod
+    @traced
+    def exists(cls, by_id) -> bool:
+        """Returns True if a record with this ID exists, without loading it"""
+        return db.session.query(db.exists().where(cls.id == by_id)).scalar()
+
+    @classmethod
+    @traced
+    def delete_by_id(cls, by_id, *criteria) -> bool:
+        """
+        Deletes the record with this ID, if it also matches criteria
+
+        Runs a single DELETE ... RETURNING instead of loading the record first.
+
+        Returns:
+            True if a record was deleted
+        """
+        logger.info("Deleting %s with id %s", cls.__name__, by_id)
+        key = getattr(cls, cls.CACHE_KEY or "id")
+        try:
+            deleted = db.session.scalars(
+                db.delete(cls)
+                .where(cls.id == by_id, *criteria)
+                .returning(key)
+                .execution_options(cache_keys_marked=True)
+            ).first()
+            if deleted is not None and cls.CACHE_KEY:
+                invalidate_on_commit({deleted})
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error deleting %s with id %s", cls.__name__, by_id)
+            raise DataValidationError(e) from e
+        return deleted is not None
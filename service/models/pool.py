@@ -0,0 +1,126 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Connection pool of the database engines
+
+The pool is sized by the DB_POOL_* settings (see service.config). Every
+worker owns its pool: connections opened before gunicorn forks, for example
+by the migrations that run while the app is created, are dropped in the
+child without being closed, so parent and child never share a socket.
+"""
+
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import Counter
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("flask.app")
+
+# Engines whose pools are replaced in a forked child
+_engines = weakref.WeakSet()
+
+
+######################################################################
+#  T I M E D   Q U E U E   P O O L
+######################################################################
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counters = Counter(checkouts=0, timeouts=0)
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+        self._depth = threading.local()
+
+    def _do_get(self):
+        """Times a checkout, including opening a new connection when one is needed"""
+        # QueuePool._do_get calls itself again after losing a race for overflow
+        if getattr(self._depth, "active", False):
+            return super()._do_get()
+        self._depth.active = True
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self._depth.active = False
+            self._record(time.perf_counter() - started, timed_out)
+
+    def _record(self, waited: float, timed_out: bool) -> None:
+        with self._stats_lock:
+            self.counters["timeouts" if timed_out else "checkouts"] += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def stats(self) -> dict:
+        """Returns the current use of the pool and its cumulative wait"""
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "idle": self.checkedin(),
+                # overflow() counts up from -size while the pool fills
+                "overflow": max(self.overflow(), 0),
+                "max_overflow": self._max_overflow,
+                "timeout": self.timeout(),
+                **self.counters,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "max_wait_seconds": round(self.max_wait_seconds, 6),
+            }
+
+
+def engine_options(app) -> dict:
+    """Returns SQLALCHEMY_ENGINE_OPTIONS with the timed pool, unless another pool was configured"""
+    return {"poolclass": TimedQueuePool, **app.config["SQLALCHEMY_ENGINE_OPTIONS"]}
+
+
+def init_pool(app, db) -> None:
+    """Registers the engines of db so that forked workers open their own connections"""
+    with app.app_context():
+        register_engines(db.engines.values())
+
+
+def register_engines(engines) -> None:
+    """Registers engines whose pools a forked worker has to replace"""
+    _engines.update(engines)
+
+
+def dispose_inherited_pools() -> None:
+    """Replaces the pools inherited from the parent without closing its connections"""
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):  # pragma: no branch - missing on Windows only
+    os.register_at_fork(after_in_child=dispose_inherited_pools)
+
+
+def pool_stats(engine) -> dict:
+    """Returns the pool statistics of an engine for this worker"""
+    pool = engine.pool
+    if isinstance(pool, TimedQueuePool):
+        return {"pid": os.getpid(), **pool.stats()}
+    return {"pid": os.getpid(), "status": pool.status()}
@@ -0,0 +1,138 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Routing of reads to read replicas
+
+When DATABASE_READ_URI names one or more replicas, the SELECT statements of
+GET and HEAD requests run on one of them, picked at random for each request,
+while everything else, and every flush, runs on the primary.
+
+Replicas lag behind the primary, so a client that has just written is sent
+to the primary for READ_YOUR_WRITES_SECONDS: every successful write sets a
+cookie that expires after that window, and requests carrying it never read
+from a replica.
+"""
+
+import contextlib
+import logging
+import random
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select, create_engine
+from . import pool
+
+logger = logging.getLogger("flask.app")
+
+STICKY_COOKIE = "read_primary"
+READ_METHODS = ("GET", "HEAD")
+
+
+######################################################################
+#  R E P L I C A   S E T
+######################################################################
+class ReplicaSet:
+    """The engines of the read replicas"""
+
+    def __init__(self):
+        self.engines = []
+
+    def configure(self, urls, engine_options: dict = None) -> None:
+        """Replaces the replicas with engines for urls, an empty list disables them"""
+        old, self.engines = self.engines, [create_engine(url, **(engine_options or {})) for url in urls]
+        pool.register_engines(self.engines)
+        for engine in old:
+            engine.dispose()
+
+    @property
+    def enabled(self) -> bool:
+        """Returns True if there is at least one replica"""
+        return bool(self.engines)
+
+    def choose(self):
+        """Returns the engine of a replica picked at random"""
+        return random.choice(self.engines)
+
+
+read_replicas = ReplicaSet()
+
+
+def parse_urls(value: str) -> list:
+    """Splits the comma separated URLs of DATABASE_READ_URI"""
+    return [url.strip() for url in (value or "").split(",") if url.strip()]
+
+
+def current_replica():
+    """Returns the replica engine the current request reads from, or None for the primary"""
+    return g.get("replica") if has_request_context() else None
+
+
+@contextlib.contextmanager
+def on_primary():
+    """Runs the reads of the block on the primary, even in a request that uses a replica"""
+    if not has_request_context():
+        yield
+        return
+    replica = g.pop("replica", None)
+    try:
+        yield
+    finally:
+        g.replica = replica
+
+
+######################################################################
+#  R O U T I N G   S E S S I O N
+######################################################################
+class RoutingSession(Session):  # pylint: disable=too-few-public-methods
+    """A session that sends the SELECT statements of read requests to their replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """Returns the replica for SELECTs outside a flush, the primary for everything else"""
+        if bind is None and not self._flushing and isinstance(clause, Select):
+            replica = current_replica()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def choose_replica() -> None:
+    """Picks the replica of a read request, unless its client has written recently"""
+    g.replica = None
+    if request.method in READ_METHODS and read_replicas.enabled and STICKY_COOKIE not in request.cookies:
+        g.replica = read_replicas.choose()
+
+
+def stick_to_primary(response):
+    """Sends the client of a successful write to the primary for the next reads"""
+    if request.method not in READ_METHODS and response.status_code < 400 and read_replicas.enabled:
+        response.set_cookie(
+            STICKY_COOKIE,
+            "1",
+            max_age=current_app.config["READ_YOUR_WRITES_SECONDS"],
+            httponly=True,
+            samesite="Lax",
+        )
+    return response
+
+
+def init_replicas(app) -> None:
+    """Connects to the replicas of DATABASE_READ_URI and routes the reads of requests"""
+    urls = parse_urls(app.config["DATABASE_READ_URI"])
+    read_replicas.configure(urls, pool.engine_options(app))
+    if urls:
+        logger.info("Reading from %d replica(s)", len(urls))
+    app.before_request(choose_replica)
+    app.after_request(stick_to_primary)
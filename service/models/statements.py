@@ -0,0 +1,226 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Timing of SQL statements
+
+Engine events time every statement sent to PostgreSQL, whether it comes
+from PersistentBase, the finders of Order and OrderItems, or a bulk
+statement. Each request adds up its statements and database time in
+flask.g, and reports them in a Server-Timing header.
+
+Statements slower than SLOW_QUERY_MS are logged with their SQL normalized
+(literals and placeholders replaced by ?, IN lists collapsed) and the
+types of their parameters, never their values. In a sampled trace every
+statement is also a span (see service.common.tracing). Each worker keeps the
+slowest ones, and with SLOW_QUERY_EXPLAIN the plan of a SELECT is
+captured with EXPLAIN when it ranks among them.
+"""
+
+import functools
+import logging
+import re
+import threading
+import time
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service.common.tracing import CLIENT, tracer
+
+logger = logging.getLogger("flask.app")
+
+STARTED = "statement_started"
+SPAN = "statement_span"
+WHITESPACE = re.compile(r"\s+")
+LITERALS = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b")
+VALUE_LISTS = re.compile(r"(?:(?<=IN )|(?<=VALUES )|(?<=\), ))\(\?(?:::\w+(?: \w+)*)?(?:, \?(?:::\w+(?: \w+)*)?)*\)")
+REPEATED_LISTS = re.compile(r"\(\.\.\.\)(?:, \(\.\.\.\))+")
+EXPLAINABLE = re.compile(r"\s*(SELECT|WITH)\b", re.IGNORECASE)
+SHAPE_ITEMS = 8
+
+
+######################################################################
+#  S L O W   Q U E R Y   L O G
+######################################################################
+class SlowQueryLog:
+    """The slowest statements of this worker, keyed by their normalized SQL"""
+
+    def __init__(self, threshold: float = None, explain: bool = False, keep: int = 20):
+        self.threshold = threshold
+        self.explain = explain
+        self.keep = keep
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def configure(self, threshold_ms: float, explain: bool, keep: int) -> None:
+        """Logs statements slower than threshold_ms (0 disables the log), dropping every entry"""
+        with self._lock:
+            self.threshold = threshold_ms / 1000 if threshold_ms > 0 else None
+            self.explain, self.keep = explain, keep
+            self._entries.clear()
+
+    @property
+    def enabled(self) -> bool:
+        """Returns False when no threshold was configured"""
+        return self.threshold is not None
+
+    def record(self, cursor, statement: str, parameters, executemany: bool, seconds: float) -> None:
+        """Logs a slow statement and keeps it if it is one of the slowest"""
+        # pylint: disable=too-many-arguments, too-many-positional-arguments
+        sql = normalize_sql(statement)
+        shape = parameter_shape(parameters, executemany)
+        plan = None
+        if self.explain and not executemany and EXPLAINABLE.match(statement) and self._ranks(sql, seconds):
+            plan = explain_statement(cursor, statement, parameters)
+        logger.warning(
+            "Slow statement (%.1f ms): %s; parameters %s%s", seconds * 1000, sql, shape, f"\n{plan}" if plan else ""
+        )
+        with self._lock:
+            entry = self._entries.setdefault(
+                sql, {"sql": sql, "parameters": shape, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "plan": None}
+            )
+            entry["count"] += 1
+            entry["total_ms"] += seconds * 1000
+            if seconds * 1000 >= entry["max_ms"]:
+                entry["max_ms"] = seconds * 1000
+                entry["parameters"] = shape
+                entry["plan"] = plan or entry["plan"]
+            if len(self._entries) > self.keep:
+                del self._entries[min(self._entries, key=lambda key: self._entries[key]["max_ms"])]
+
+    def _ranks(self, sql: str, seconds: float) -> bool:
+        """Returns True if the statement is slower than its kept runs and among the slowest"""
+        with self._lock:
+            entry = self._entries.get(sql)
+            if entry is not None:
+                return seconds * 1000 > entry["max_ms"] or entry["plan"] is None
+            if len(self._entries) < self.keep:
+                return True
+            return seconds * 1000 > min(entry["max_ms"] for entry in self._entries.values())
+
+    def slowest(self) -> list:
+        """Returns the kept statements, the slowest first"""
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        for entry in entries:
+            entry["total_ms"] = round(entry["total_ms"], 3)
+            entry["max_ms"] = round(entry["max_ms"], 3)
+        return sorted(entries, key=lambda entry: entry["max_ms"], reverse=True)
+
+    def clear(self) -> None:
+        """Drops every kept statement"""
+        with self._lock:
+            self._entries.clear()
+
+
+slow_queries = SlowQueryLog()
+
+
+@functools.lru_cache(maxsize=512)
+def normalize_sql(statement: str) -> str:
+    """Returns the statement on one line with its literals, placeholders and value lists replaced"""
+    sql = LITERALS.sub("?", WHITESPACE.sub(" ", statement).strip())
+    return REPEATED_LISTS.sub("(...), ...", VALUE_LISTS.sub("(...)", sql))
+
+
+def parameter_shape(parameters, executemany: bool = False) -> str:
+    """Describes the parameters of a statement by their names and types"""
+    if executemany:
+        return f"{len(parameters)} x {parameter_shape(parameters[0])}" if parameters else "[]"
+    if isinstance(parameters, dict):
+        items = [f"{name}: {type(value).__name__}" for name, value in parameters.items()]
+        opening, closing = "{", "}"
+    elif isinstance(parameters, (list, tuple)):
+        items = [type(value).__name__ for value in parameters]
+        opening, closing = "(", ")"
+    else:
+        return type(parameters).__name__
+    if len(items) > SHAPE_ITEMS:
+        items = items[:SHAPE_ITEMS] + [f"... {len(items) - SHAPE_ITEMS} more"]
+    return opening + ", ".join(items) + closing
+
+
+def explain_statement(cursor, statement: str, parameters) -> str:
+    """Returns the plan of a statement, without running it, on the connection that ran it"""
+    connection = cursor.connection
+    try:
+        # A savepoint keeps a failed EXPLAIN from aborting the transaction
+        with connection.transaction(), connection.cursor() as explaining:
+            explaining.execute(f"EXPLAIN {statement}", parameters)
+            return "\n".join(row[0] for row in explaining.fetchall())
+    except Exception as error:  # pylint: disable=broad-except
+        logger.info("Cannot explain a slow statement: %s", error)
+        return None
+
+
+######################################################################
+#  S Q L A L C H E M Y   A N D   F L A S K   H O O K S
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+    """Notes when a statement was sent, on every engine"""
+    span = tracer.start_span(statement.split(None, 1)[0].upper(), CLIENT)
+    if span is not None:
+        span.attributes.update({"db.system": "postgresql", "db.statement": normalize_sql(statement)})
+        conn.info[SPAN] = span
+    conn.info[STARTED] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    """Adds the statement to the request and logs it when it was slow"""
+    # pylint: disable=unused-argument, too-many-arguments, too-many-positional-arguments
+    seconds = time.perf_counter() - conn.info.pop(STARTED, time.perf_counter())
+    tracer.finish(conn.info.pop(SPAN, None))
+    if has_request_context() and "db_statements" in g:
+        g.db_statements += 1
+        g.db_seconds += seconds
+    if slow_queries.enabled and seconds >= slow_queries.threshold:
+        slow_queries.record(cursor, statement, parameters, executemany, seconds)
+
+
+@event.listens_for(Engine, "handle_error")
+def fail_statement(context) -> None:
+    """Ends the span of a statement that raised"""
+    if context.connection is not None:
+        context.connection.info.pop(STARTED, None)
+        tracer.finish(context.connection.info.pop(SPAN, None), context.original_exception)
+
+
+def start_request() -> None:
+    """Starts counting the statements and database time of a request"""
+    g.db_statements = 0
+    g.db_seconds = 0.0
+    g.request_started = time.perf_counter()
+
+
+def add_server_timing(response):
+    """Reports the database time and statements of the request, and its total time so far"""
+    if "db_statements" in g:
+        elapsed = time.perf_counter() - g.request_started
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={g.db_seconds * 1000:.2f};desc="{g.db_statements} statements", app;dur={elapsed * 1000:.2f}',
+        )
+    return response
+
+
+def init_statements(app) -> None:
+    """Counts the statements of every request and configures the slow query log"""
+    slow_queries.configure(app.config["SLOW_QUERY_MS"], app.config["SLOW_QUERY_EXPLAIN"], app.config["SLOW_QUERY_KEEP"])
+    app.before_request(start_request)
+    if app.config["SERVER_TIMING"]:
+        app.after_request(add_server_timing)
@@ -21,10 +21,21 @@ This service implements a REST API that allows you to Create, Read, Update
 and Delete YourResourceModel
 """
 import datetime
-from flask import jsonify, request, abort
+import sys
+from flask import jsonify, request, abort, url_for, send_file
 from flask import current_app as app  # Import Flask application
-from service.models import OrderItems, Order
+from service.models import (
+    OrderItems, Order, DataValidationError, ORDER_FILTERS, ITEM_FILTERS, keyset_query, paginate, parse_limit,
+    order_cache, cached_order, peek_order, order_serializer, db, pool_stats, slow_queries,
+)
 from service.common import status  # HTTP Status Codes
+from service.common.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics
+from service.common.conditional import is_conditional, is_fresh, make_etag, not_modified, with_etag
+from service.common.streaming import stream_json_array, wants_stream
+from service.common.profiling import PROFILE_PARAM, profiles, request_profiler
+
+# Query parameters that page through a collection rather than filter it
+PAGE_PARAMS = ("sort", "limit", "cursor", "stream", "fields", "include", PROFILE_PARAM)
 
 
 ######################################################################
@@ -45,6 +56,67 @@ def health():
     return jsonify({"status": "OK"}), status.HTTP_200_OK
 
 
+######################################################################
+# ORDER CACHE STATISTICS
+######################################################################
+@app.route("/admin/cache")
+def cache_stats():
+    """Returns the hit and miss counters of this worker's order cache"""
+    check_admin()
+    return jsonify(order_cache.stats()), status.HTTP_200_OK
+
+
+######################################################################
+# CONNECTION POOL STATISTICS
+######################################################################
+@app.route("/admin/pool")
+def pool_statistics():
+    """Returns the connections this worker holds and how long it waited for them"""
+    check_admin()
+    return jsonify(pool_stats(db.engine)), status.HTTP_200_OK
+
+
+######################################################################
+# SLOW STATEMENTS
+######################################################################
+@app.route("/admin/slow-queries")
+def slow_statements():
+    """Returns the slowest statements of this worker, with their plans when captured"""
+    check_admin()
+    return jsonify(slow_queries.slowest()), status.HTTP_200_OK
+
+
+######################################################################
+# REQUEST PROFILES AND SAMPLED STACKS
+######################################################################
+@app.route("/admin/profiles")
+def list_profiles():
+    """Returns the profiles kept by the workers of this server, the latest first"""
+    check_admin()
+    return jsonify(profiles.entries()), status.HTTP_200_OK
+
+
+@app.route("/admin/profiles/<profile_id>")
+def get_profile(profile_id):
+    """Downloads the .pstats of a profiled request or the .folded stacks of a sampler window"""
+    check_admin()
+    path = profiles.path(profile_id)
+    if path is None:
+        abort(status.HTTP_404_NOT_FOUND, f"Profile '{profile_id}' was not found.")
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True, download_name=profile_id)
+
+
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics")
+def prometheus_metrics():
+    """Returns the request metrics of every worker sharing METRICS_DIR"""
+    if not metrics.enabled:
+        abort(status.HTTP_404_NOT_FOUND, "Metrics are disabled.")
+    return app.response_class(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
 ######################################################################
 #  R E S T   A P I   E N D P O I N T S
 ######################################################################
@@ -60,34 +132,22 @@ def get_orderitem(order_id, item_id):
     """
     app.logger.info("Request to Retrieve an order item with id [%s]", item_id)
 
-    # Attempt to find the Order Item and abort if not found
-    orderitem = OrderItems.find(item_id)
-    if not orderitem:
-        abort(
-            status.HTTP_404_NOT_FOUND, f"Order Item with id '{item_id}' was not found."
-        )
+    # Any change to an item bumps the row_version of its order
+    if is_conditional():
+        etag = make_etag("item", order_id, item_id, Order.version(order_id))
+        if is_fresh(etag):
+            return not_modified(etag)
 
-    # Check if order_id exists if not exists, raise exception
-    order = Order.find(order_id)
-    if order is None:
-        abort(status.HTTP_404_NOT_FOUND)
-
-    # Check if the order_id in the path is the same as the order_id in the json
-    if orderitem.order_id != order_id:
-        app.logger.error(
-            "Path order_id: %s does not match json order_id: %s",
-            order_id,
-            orderitem.order_id,
-        )
-        print(
-            "Path order_id: %s does not match json order_id: %s",
-            order_id,
-            orderitem.order_id,
-        )
-        abort(status.HTTP_400_BAD_REQUEST)
+    # Serve the item from the cached order, the lookup tells the errors apart
+    order, version = cached_order(order_id, lambda: load_order(order_id)) or (None, None)
+    items = [item for item in order["orderitems"] if item["id"] == item_id] if order else []
+    orderitem = items[0] if items else find_orderitem_or_abort(order_id, item_id).serialize()
 
     app.logger.info("Returning order item: %s", item_id)
-    return jsonify(orderitem.serialize()), status.HTTP_200_OK
+    response = jsonify(orderitem)
+    if order:
+        with_etag(response, make_etag("item", order_id, item_id, version))
+    return response, status.HTTP_200_OK
 
 
 # CREATE AN ORDER
@@ -118,6 +178,64 @@ def create_order():
     return message, status.HTTP_201_CREATED
 
 
+# CREATE ORDERS IN BULK
+@app.route("/orders/batch", methods=["POST"])
+def create_orders_batch():
+    """
+    Create several Orders at once
+
+    The body is a JSON array of orders, each with its nested orderitems.
+    Every entry is validated on its own and all valid entries are inserted
+    in a single transaction. The response lists the outcome of each entry
+    in request order and is 201 when all of them were created, 207 otherwise.
+    """
+    app.logger.info("Request to create a batch of Orders")
+    check_content_type("application/json")
+    entries = request.get_json()
+    if not isinstance(entries, list):
+        raise DataValidationError("Invalid batch: body must be a JSON array of orders")
+    if len(entries) > app.config["BATCH_MAX_ORDERS"]:
+        raise DataValidationError(
+            f"Invalid batch: {len(entries)} orders given, at most {app.config['BATCH_MAX_ORDERS']} are allowed"
+        )
+
+    results = [None] * len(entries)
+    orders = {}
+    now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    for position, entry in enumerate(entries):
+        try:
+            orders[position] = batch_order(entry, now)
+        except DataValidationError as error:
+            results[position] = {"index": position, "status": status.HTTP_400_BAD_REQUEST, "error": str(error)}
+
+    errors = Order.create_many(list(orders.values()))
+    for (position, order), error in zip(orders.items(), errors):
+        if error:
+            results[position] = {"index": position, "status": status.HTTP_400_BAD_REQUEST, "error": error}
+        else:
+            results[position] = {"index": position, "status": status.HTTP_201_CREATED, "order": order.serialize()}
+
+    created = sum(1 for result in results if result["status"] == status.HTTP_201_CREATED)
+    app.logger.info("Created %d of %d orders in batch", created, len(entries))
+    code = status.HTTP_201_CREATED if created == len(entries) else status.HTTP_207_MULTI_STATUS
+    return jsonify(created=created, failed=len(entries) - created, results=results), code
+
+
+def batch_order(entry, now: str) -> Order:
+    """Builds an Order from one entry of a batch, the same way create_order does"""
+    if not isinstance(entry, dict):
+        raise DataValidationError("Invalid Order: entry must be a JSON object")
+    entry = dict(entry, order_created=now, order_updated=now)
+    entry.setdefault("orderitems", [])
+    if not isinstance(entry["orderitems"], list):
+        raise DataValidationError("Invalid Order: orderitems must be a JSON array")
+    # The order id is not known yet, the relationship fills it in on insert
+    entry["orderitems"] = [
+        dict(item, order_id=None) if isinstance(item, dict) else item for item in entry["orderitems"]
+    ]
+    return Order().deserialize(entry)
+
+
 # CREATE AN ORDER ITEM
 @app.route("/orders/<int:order_id>/items", methods=["POST"])
 def create_orderitem(order_id):
@@ -129,9 +247,8 @@ def create_orderitem(order_id):
     app.logger.info("Request to create an Order Item")
 
     # Check if order_id exists if not exists, raise exception
-    order = Order.find(order_id)
-    if order is None:
-        abort(status.HTTP_404_NOT_FOUND)
+    if not Order.exists(order_id):
+        abort(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
 
     orderitem = OrderItems()
 
@@ -154,74 +271,102 @@ def get_orders(order_id):
     Retrieve a single Order
 
     This endpoint will return an Order based on it's id
+
+    Query Parameters:
+        fields (string): comma separated columns to return instead of the whole order
+        include (string): orderitems, to add the items to the fields
     """
     app.logger.info("Request to Retrieve an order with id [%s]", order_id)
+    columns, with_items = Order.fieldset(request.args.get("fields"), request.args.get("include"))
+
+    # Revalidation only needs the row_version, not the order and its items
+    if is_conditional():
+        etag = make_etag("order", order_id, Order.version(order_id), columns, with_items)
+        if is_fresh(etag):
+            return not_modified(etag)
 
     # Attempt to find the Order and abort if not found
-    order = Order.find(order_id)
+    order, version = read_order(order_id, columns, with_items)
     if not order:
         abort(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
 
     app.logger.info("Returning order: %s", order_id)
-    return jsonify(order.serialize()), status.HTTP_200_OK
+    response = jsonify(order)
+    with_etag(response, make_etag("order", order_id, version, columns, with_items))
+    return response, status.HTTP_200_OK
 
 
 # GET A LIST OF ORDERS
 @app.route("/orders", methods=["GET"])
 def list_orders():
-    """Returns all of the Orders"""
-    app.logger.info("Request for order list")
+    """
+    Returns a page of Orders
 
-    orders = []
-    valid_filters = ["customer", "status", "date"]
-
-    # Check for invalid query parameters
-    for param in request.args:
-        if param not in valid_filters:
-            app.logger.error("Invalid filter parameter: %s", param)
-            return (
-                jsonify(
-                    status=status.HTTP_400_BAD_REQUEST,
-                    error="Bad Request",
-                    message=f"Invalid filter parameter: {param}. Valid filters are: {', '.join(valid_filters)}",
-                ),
-                status.HTTP_400_BAD_REQUEST,
-            )
+    Query Parameters:
+        customer (int): only orders of this customer
+        status (string): only orders in this status, several may be given as status=a,b
+        date (string): only orders created on this day (YYYY-MM-DD)
+        sort (string): column to sort by, prefixed with '-' for descending (default id)
+        limit (int): page size, capped at PAGE_SIZE_MAX
+        cursor (string): opaque cursor taken from the previous page's "next" link
+        stream (bool): send every matching order as one streamed JSON array
+        fields (string): comma separated columns to return instead of whole orders
+        include (string): orderitems, to add the items to the fields
+
+    Filters can be combined, an order has to match all of them.
+    """
+    app.logger.info("Request for order list")
 
-    # Parse arguments from the query string
-    customer_id = request.args.get("customer")
-    order_status = request.args.get("status")
-    order_date = request.args.get("date")
-    # Apply filters based on query parameters
-    if customer_id:
-        app.logger.info("Find by customer: %s", customer_id)
-        orders = Order.find_by_customer(customer_id)
-    elif order_status:
-        app.logger.info("Find by status: %s", order_status)
-        orders = Order.find_by_status(order_status)
-    elif order_date:
-        app.logger.info("Find by date: %s", order_date)
-        try:
-            # Validate date format (YYYY-MM-DD)
-            datetime.datetime.strptime(order_date, "%Y-%m-%d")
-            orders = Order.find_by_date(order_date)
-        except ValueError:
-            app.logger.error("Invalid date format: %s", order_date)
-            return (
-                jsonify(
-                    status=status.HTTP_400_BAD_REQUEST,
-                    error="Bad Request",
-                    message="Invalid date format. Date must be in YYYY-MM-DD format.",
-                ),
-                status.HTTP_400_BAD_REQUEST,
-            )
+    ORDER_FILTERS.check_params(request.args, PAGE_PARAMS)
+    app.logger.info("Find by filters: %s", ORDER_FILTERS.given(request.args))
+    sort = request.args.get("sort", "id")
+    columns, with_items = Order.fieldset(request.args.get("fields"), request.args.get("include"))
+    if wants_stream(request.args):
+        return stream_orders(sort, columns, with_items)
+
+    # The items are only read once the page turns out not to be fresh, and
+    # only the requested columns plus the sort key and row_version are selected
+    query = Order.query.options(
+        *Order.loader_options("noload"), *Order.column_options(columns, sort.lstrip("-"), "row_version")
+    )
+    query = query.filter(ORDER_FILTERS.where(request.args))
+    limit = parse_limit(
+        request.args.get("limit"),
+        app.config["PAGE_SIZE_DEFAULT"],
+        app.config["PAGE_SIZE_MAX"],
+    )
+    page = paginate(query, Order, sort, limit, request.args.get("cursor"))
+    etag = make_etag("orders", request.query_string, [(order.id, order.row_version) for order in page.items])
+    if is_fresh(etag):
+        response = not_modified(etag)
     else:
-        app.logger.info("Find all")
-        orders = Order.all()
+        if with_items:
+            Order.load_items(page.items)
+        results = order_serializer(columns, with_items).many(page.items)
+        app.logger.info("Returning %d orders", len(results))
+        response = with_etag(jsonify(results), etag)
+    if page.next_cursor:
+        response.headers["Link"] = next_link("list_orders", limit, page.next_cursor)
+    return response
 
-    results = [order.serialize() for order in orders]
-    app.logger.info("Returning %d orders", len(results))
-    return jsonify(results), status.HTTP_200_OK
+
+def stream_orders(sort, columns: tuple, with_items: bool):
+    """
+    Streams all matching orders instead of a page
+
+    Rows come from a server-side cursor in batches of STREAM_BATCH_SIZE and
+    are written out as they arrive, so memory stays flat however many
+    orders match. The page size cap does not apply, but an explicit limit
+    is honored. Items are read with one query per batch, if requested.
+    """
+    query = Order.query.options(*Order.column_options(columns, sort.lstrip("-")))
+    query = query.filter(ORDER_FILTERS.where(request.args))
+    query = keyset_query(query, Order, sort, request.args.get("cursor"))
+    if request.args.get("limit"):
+        query = query.limit(parse_limit(request.args["limit"], sys.maxsize, sys.maxsize))
+    app.logger.info("Streaming orders sorted by %s", sort)
+    orders = Order.stream(query, app.config["STREAM_BATCH_SIZE"], with_items)
+    return stream_json_array(orders, order_serializer(columns, with_items))
 
 
 # DELETE AN ORDER ITEM
@@ -241,18 +386,8 @@ def delete_orderitem(order_id, product_id):
     """
     app.logger.info("Request to delete an Order Item")
 
-    # Check if order_id exists if not exists, return 204
-    order = Order.find(order_id)
-    if order is None:
-        return {}, status.HTTP_204_NO_CONTENT
-
-    # Check if orderproduct_id exists if not exists, return 204
-    orderitem = OrderItems.find(product_id)
-    if orderitem is None:
-        return {}, status.HTTP_204_NO_CONTENT
-
-    # Delete the Order Item
-    orderitem.delete()
+    # Delete the Order Item if it is part of the order, it is fine if either is missing
+    OrderItems.delete_by_id(product_id, OrderItems.order_id == order_id)
     return {}, status.HTTP_204_NO_CONTENT
 
 
@@ -271,10 +406,8 @@ def delete_order(order_id):
         status: HTTP_204_NO_CONTENT
     """
     app.logger.info("Request to delete an Order")
-    order = Order.find(order_id)
-    if order is None:
-        return "", status.HTTP_204_NO_CONTENT
-    order.delete()
+    # The database deletes the items through ON DELETE CASCADE
+    Order.delete_by_id(order_id)
     return {}, status.HTTP_204_NO_CONTENT
 
 
@@ -342,28 +475,8 @@ def update_items(order_id, item_id):
     app.logger.info("Request to update Item %s for Order id: %s", item_id, order_id)
     check_content_type("application/json")
 
-    # See if the item exists and abort if it doesn't
-    orderitem = OrderItems.find(item_id)
-    if not orderitem:
-        abort(
-            status.HTTP_404_NOT_FOUND,
-            f"Item with id '{item_id}' could not be found.",
-        )
-
-    # Check if the order exists
-    order = Order.find(order_id)
-    if not order:
-        abort(
-            status.HTTP_404_NOT_FOUND,
-            f"Order with id '{order_id}' could not be found.",
-        )
-
-    # Check if the order_id in the path matches the order_id of the item
-    if orderitem.order_id != order_id:
-        abort(
-            status.HTTP_400_BAD_REQUEST,
-            f"Item with id '{item_id}' does not belong to order with id '{order_id}'.",
-        )
+    # See if the item exists in this order and abort if it doesn't
+    orderitem = find_orderitem_or_abort(order_id, item_id)
 
     # Get the request data
     data = request.get_json()
@@ -379,14 +492,12 @@ def update_items(order_id, item_id):
                 "Quantity must be a positive integer.",
             )
 
-    # Update from the json in the body of the request
+    # Update from the json in the body of the request and the order's
+    # updated timestamp, committed together
     orderitem.deserialize(request.get_json())
+    Order.touch(order_id)
     orderitem.update()
 
-    # Update the order's updated timestamp
-    order.order_updated = datetime.datetime.now()
-    order.update()
-
     return jsonify(orderitem.serialize()), status.HTTP_200_OK
 
 
@@ -401,36 +512,39 @@ def list_orderitems(order_id):
     a status of 204 (No Content) will be returned.
 
     Query Parameters:
-        search (string): Search term to filter items by product_id
+        search (string): only items whose product_id starts with this prefix
+        product_id (int): only items for exactly this product
+        min_quantity, max_quantity (int): inclusive range of the quantity
+        min_price, max_price (float): inclusive range of the price
+        stream (bool): stream the items as they are read from the database
     """
     app.logger.info("Request for order item list")
-
-    # Check if order exists
-    order = Order.find(order_id)
-    if order is None:
+    ITEM_FILTERS.check_params(request.args, ("stream", PROFILE_PARAM))
+
+    # Let the database pick out the matching items
+    app.logger.info("Find items by filters: %s", ITEM_FILTERS.given(request.args))
+    if wants_stream(request.args):
+        # The status cannot change once streaming starts, so check the order first
+        if not Order.exists(order_id):
+            return "", status.HTTP_204_NO_CONTENT
+        query = OrderItems.order_query(order_id, ITEM_FILTERS.where(request.args))
+        return stream_json_array(query.yield_per(app.config["STREAM_BATCH_SIZE"]), OrderItems.serialize)
+    # Revalidation only needs the row_version of the order
+    if is_conditional():
+        etag = make_etag("items", order_id, request.query_string, Order.version(order_id))
+        if is_fresh(etag):
+            return not_modified(etag)
+
+    # One query tells if the order exists and returns its version and items
+    version, orderitems = Order.items_with_version(order_id, ITEM_FILTERS.where(request.args))
+    if version is None:
         return "", status.HTTP_204_NO_CONTENT
 
-    # Get search parameter if it exists
-    search_term = request.args.get("search", "")
-
-    # Get all items for the order
-    orderitems = OrderItems.find_by_order_id(order_id)
-
-    # Filter items if search term is provided
-    if search_term:
-        app.logger.info(f"Filtering items with search term: {search_term}")
-        filtered_items = []
-        for item in orderitems:
-            # Convert product_id to string for comparison
-            if search_term.lower() in str(item.product_id).lower():
-                filtered_items.append(item)
-        results = [orderitem.serialize() for orderitem in filtered_items]
-        app.logger.info("Returning %d filtered order items", len(results))
-    else:
-        results = [orderitem.serialize() for orderitem in orderitems]
-        app.logger.info("Returning %d order items", len(results))
-
-    return jsonify(results), status.HTTP_200_OK
+    results = [orderitem.serialize() for orderitem in orderitems]
+    app.logger.info("Returning %d order items", len(results))
+    response = jsonify(results)
+    with_etag(response, make_etag("items", order_id, request.query_string, version))
+    return response, status.HTTP_200_OK
 
 
 ######################################################################
@@ -460,6 +574,133 @@ def check_content_type(content_type) -> None:
     )
 
 
+######################################################################
+# Finds an item of an order in one query
+######################################################################
+def find_orderitem_or_abort(order_id: int, item_id: int) -> OrderItems:
+    """
+    Returns the item with item_id if it belongs to the order, else aborts
+
+    The common case takes a single scoped query. Only when that misses are
+    the item and the order looked up separately, to answer 404 for a
+    missing one and 400 for an item of another order.
+    """
+    orderitem = OrderItems.find_in_order(order_id, item_id)
+    if orderitem:
+        return orderitem
+    if not OrderItems.exists(item_id):
+        abort(status.HTTP_404_NOT_FOUND, f"Order Item with id '{item_id}' was not found.")
+    if not Order.exists(order_id):
+        abort(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
+    app.logger.error("Order Item %s does not belong to order %s", item_id, order_id)
+    abort(
+        status.HTTP_400_BAD_REQUEST,
+        f"Item with id '{item_id}' does not belong to order with id '{order_id}'.",
+    )
+    return None
+
+
+######################################################################
+# Loads an order for the cache
+######################################################################
+def load_order(order_id: int) -> tuple:
+    """Returns the serialized order with this id and its row_version, or None if there is none"""
+    order = Order.find(order_id)
+    return (order.serialize(), order.row_version) if order else None
+
+
+def read_order(order_id: int, columns: tuple, with_items: bool) -> tuple:
+    """
+    Returns the order serialized with the requested fields and its row_version
+
+    Whole orders are read through the order cache. Sparse reads are projected
+    from a cached order if there is one, otherwise they select only the
+    requested columns and read the items only if they were asked for.
+    """
+    if columns is None:
+        return cached_order(order_id, lambda: load_order(order_id)) or (None, None)
+    serializer = order_serializer(columns, with_items)
+    cached = peek_order(order_id)
+    if cached is not None:
+        order, version = cached
+        return serializer.project(order), version
+    order = Order.find_fields(order_id, columns + ("row_version",), with_items)
+    return (serializer(order), order.row_version) if order else (None, None)
+
+
+######################################################################
+# Only lets requests with the ADMIN_TOKEN through
+######################################################################
+def check_admin():
+    """Aborts unless ADMIN_TOKEN is set and the request carries it as a bearer token"""
+    if not request_profiler.enabled:
+        abort(status.HTTP_404_NOT_FOUND, "The admin routes are disabled, set ADMIN_TOKEN to enable them.")
+    if not request_profiler.bearer_token():
+        abort(status.HTTP_401_UNAUTHORIZED, "The admin token is required.")
+    if not request_profiler.is_admin():
+        abort(status.HTTP_403_FORBIDDEN, "The admin token is not valid.")
+
+
+######################################################################
+# Builds the Link header that points at the next page
+######################################################################
+def next_link(endpoint: str, limit: int, cursor: str, **values) -> str:
+    """Returns an RFC 8288 Link header value for the next page of a collection"""
+    args = request.args.to_dict(flat=False)
+    args.update(values, limit=limit, cursor=cursor)
+    return f'<{url_for(endpoint, **args)}>; rel="next"'
+
+
+######################################################################
+# SUMMARIZE THE ORDERS OF A CUSTOMER
+######################################################################
+@app.route("/customers/<int:customer_id>/summary", methods=["GET"])
+def get_customer_summary(customer_id):
+    """
+    Returns the order statistics of a customer
+
+    The counts, total spent, last order date and orders per status are
+    computed by the database, so the response has the same small size
+    however many orders the customer has. A customer without orders gets
+    zeros rather than a 404, as customers are not stored by this service.
+    """
+    app.logger.info("Request for the order summary of customer %s", customer_id)
+    return jsonify(Order.customer_summary(customer_id)), status.HTTP_200_OK
+
+
+######################################################################
+# MOVE MANY ORDERS TO A NEW STATUS
+######################################################################
+@app.route("/orders/transition", methods=["POST"])
+def transition_orders():
+    """
+    Moves every Order that matches a filter to a new status
+
+    The body holds the target "status" and a "filters" object that takes the
+    same filters as list_orders, for example
+    {"status": "canceled", "filters": {"customer": 7, "created_before": "2025-01-01"}}.
+    Orders that are not in a status the target may be reached from (see
+    Order.TRANSITIONS) are skipped. At least one filter is required.
+    """
+    app.logger.info("Request to transition Orders")
+    check_content_type("application/json")
+    body = request.get_json()
+    if not isinstance(body, dict) or "status" not in body:
+        raise DataValidationError("Invalid transition: body must hold the target status")
+    filters = body.get("filters") or {}
+    if not isinstance(filters, dict):
+        raise DataValidationError("Invalid transition: filters must be a JSON object")
+    ORDER_FILTERS.check_params(filters)
+    if not ORDER_FILTERS.given(filters):
+        raise DataValidationError("Invalid transition: at least one filter is required")
+
+    app.logger.info("Transition %s to %s", ORDER_FILTERS.given(filters), body["status"])
+    transitioned, skipped = Order.transition(
+        ORDER_FILTERS.where(filters), body["status"], app.config["TRANSITION_CHUNK_SIZE"]
+    )
+    return jsonify(status=str(body["status"]).lower(), transitioned=transitioned, skipped=skipped), status.HTTP_200_OK
+
+
 ######################################################################
 # CANCEL AN ORDER
 ######################################################################
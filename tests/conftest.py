@@ -0,0 +1,30 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test fixtures shared by every test module
+"""
+
+import pytest
+from wsgi import app
+from service.models import db, migrations
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database_schema():
+    """Migrates the test database once, like `flask db-upgrade` does before a release"""
+    with app.app_context():
+        migrations.upgrade(db.engine)
@@ -0,0 +1,29 @@
+"""
+Test helper that counts the SQL statements sent to the database
+"""
+
+from sqlalchemy import event
+from service.models import db
+
+
+class QueryCounter:
+    """Context manager that records every statement executed on the engine"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(db.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(db.engine, "before_cursor_execute", self._record)
+
+    # pylint: disable=too-many-arguments, too-many-positional-arguments, unused-argument
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self) -> int:
+        """Number of statements executed so far"""
+        return len(self.statements)
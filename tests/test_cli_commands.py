@@ -26,7 +26,7 @@ from click.testing import CliRunner
 
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from service.common.cli_commands import db_create, db_upgrade, db_status  # noqa: E402
 
 
 class TestFlaskCLI(TestCase):
@@ -35,10 +35,43 @@ class TestFlaskCLI(TestCase):
     def setUp(self):
         self.runner = CliRunner()
 
+    @patch("service.common.cli_commands.migrations")
     @patch("service.common.cli_commands.db")
-    def test_db_create(self, db_mock):
+    def test_db_create(self, db_mock, migrations_mock):
         """It should call the db-create command"""
         db_mock.return_value = MagicMock()
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+            migrations_mock.upgrade.assert_called_once()
+
+    @patch("service.common.cli_commands.migrations")
+    def test_db_upgrade(self, migrations_mock):
+        """It should apply the pending migrations"""
+        migration = MagicMock(version=2, description="Add indexes")
+        migrations_mock.upgrade.return_value = [migration]
+        result = self.runner.invoke(db_upgrade, ["--target", "2"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Applied 2: Add indexes", result.output)
+        self.assertEqual(migrations_mock.upgrade.call_args.args[1], 2)
+
+        migrations_mock.upgrade.return_value = []
+        result = self.runner.invoke(db_upgrade)
+        self.assertIn("up to date", result.output)
+
+    @patch("service.common.cli_commands.migrations")
+    def test_db_status(self, migrations_mock):
+        """It should report pending migrations and schema drift"""
+        migrations_mock.pending_migrations.return_value = []
+        migrations_mock.check_schema.return_value = []
+        result = self.runner.invoke(db_status)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("matches the models", result.output)
+
+        migration = MagicMock(version=3, description="Add totals")
+        migrations_mock.pending_migrations.return_value = [migration]
+        migrations_mock.check_schema.return_value = ["missing column order.total"]
+        result = self.runner.invoke(db_status)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Pending 3: Add totals", result.output)
+        self.assertIn("Drift: missing column order.total", result.output)
@@ -0,0 +1,83 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the query filter engine
+"""
+
+from unittest import TestCase
+from werkzeug.datastructures import MultiDict
+from wsgi import app  # noqa: F401  pylint: disable=unused-import
+from service.models import Order, ORDER_FILTERS, DataValidationError
+
+
+######################################################################
+#        F I L T E R   T E S T   C A S E S
+######################################################################
+class TestFilters(TestCase):
+    """Filter Engine Test Cases"""
+
+    def _sql(self, **args):
+        """Compiles the filters for args into SQL and its bound parameters"""
+        compiled = ORDER_FILTERS.where(MultiDict(args)).compile()
+        return str(compiled), compiled.params
+
+    def test_no_filters(self):
+        """It should match everything when no filter is given"""
+        self.assertEqual(self._sql()[0], "true")
+        self.assertEqual(self._sql(customer="", status="")[0], "true")
+
+    def test_single_filter(self):
+        """It should compile a single filter into a parameterized criterion"""
+        criterion = ORDER_FILTERS.where(MultiDict({"customer": "7"}))
+        self.assertEqual(criterion.right.value, 7)
+        self.assertIs(criterion.left.table, Order.__table__)
+
+    def test_combined_filters(self):
+        """It should AND every filter that is given"""
+        sql, params = self._sql(customer="7", status="pending,shipped", date="2024-02-29")
+        self.assertIn('"order".customer_id = :customer_id_1', sql)
+        self.assertIn('"order".order_status IN (__[POSTCOMPILE_order_status_1])', sql)
+        self.assertIn('"order".order_created >= CAST(:param_1 AS DATE)', sql)
+        self.assertEqual(sql.count(" AND "), 3)
+        self.assertEqual(params["customer_id_1"], 7)
+        self.assertEqual(params["order_status_1"], ["pending", "shipped"])
+
+    def test_repeated_values(self):
+        """It should merge repeated and comma separated values of a multi-valued filter"""
+        args = MultiDict([("status", "a,b"), ("status", "c")])
+        self.assertEqual(ORDER_FILTERS.filters["status"].values(args), ["a", "b", "c"])
+        self.assertEqual(ORDER_FILTERS.given(args), {"status": ["a", "b", "c"]})
+
+    def test_invalid_values(self):
+        """It should raise the declared message for values that do not parse"""
+        with self.assertRaises(DataValidationError) as context:
+            ORDER_FILTERS.where(MultiDict({"date": "2024-13-01"}))
+        self.assertIn("YYYY-MM-DD", str(context.exception))
+        with self.assertRaises(DataValidationError) as context:
+            ORDER_FILTERS.where(MultiDict({"customer": "seven"}))
+        self.assertIn("Invalid customer: 'seven'", str(context.exception))
+        with self.assertRaises(DataValidationError) as context:
+            ORDER_FILTERS.where(MultiDict({"created_before": "yesterday"}))
+        self.assertIn("Invalid created_before: 'yesterday'", str(context.exception))
+
+    def test_check_params(self):
+        """It should reject parameters that are neither filters nor extras"""
+        ORDER_FILTERS.check_params(MultiDict({"customer": "1", "limit": "5"}), extra=("limit",))
+        with self.assertRaises(DataValidationError) as context:
+            ORDER_FILTERS.check_params(MultiDict({"colour": "red"}), extra=("limit",))
+        self.assertIn("Valid filters are: customer, status, date, created_after", str(context.exception))
+        self.assertTrue(str(context.exception).endswith("max_items, limit"))
@@ -0,0 +1,135 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+# pylint: disable=duplicate-code
+
+"""
+Test cases for the schema migration runner
+
+Every test runs against its own empty PostgreSQL schema so that the
+migrations can be applied from scratch without touching the test tables.
+"""
+
+import logging
+from unittest import TestCase
+from sqlalchemy import create_engine, text
+from wsgi import app
+from service.models import db, migrations
+
+SCHEMA = "migration_test"
+
+
+######################################################################
+#        M I G R A T I O N   T E S T   C A S E S
+######################################################################
+class TestMigrations(TestCase):
+    """Schema Migration Test Cases"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+        cls.engine = create_engine(
+            db.engine.url, connect_args={"options": f"-csearch_path={SCHEMA}"}
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        with cls.engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        cls.engine.dispose()
+
+    def setUp(self):
+        """This runs before each test"""
+        with self.engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+    def _execute(self, statement: str):
+        with self.engine.begin() as connection:
+            connection.execute(text(statement))
+
+    ######################################################################
+    #  T E S T   C A S E S
+    ######################################################################
+
+    def test_upgrade_from_empty(self):
+        """It should apply every migration to an empty database exactly once"""
+        applied = migrations.upgrade(self.engine)
+        self.assertEqual([m.version for m in applied], [m.version for m in migrations.MIGRATIONS])
+        self.assertEqual(migrations.pending_migrations(self.engine), [])
+        self.assertEqual(migrations.check_schema(self.engine), [])
+        self.assertEqual(migrations.upgrade(self.engine), [])
+
+    def test_upgrade_to_target(self):
+        """It should stop at the target version and report what is pending"""
+        migrations.upgrade(self.engine, target=1)
+        pending = migrations.pending_migrations(self.engine)
+        self.assertEqual(pending[0].version, 2)
+        problems = migrations.check_schema(self.engine)
+        self.assertIn("missing index ix_order_customer_id on order", problems)
+        migrations.upgrade(self.engine)
+        self.assertEqual(migrations.check_schema(self.engine), [])
+
+    def test_upgrade_existing_tables(self):
+        """It should adopt tables that were created before migrations existed"""
+        with self.engine.begin() as connection:
+            db.metadata.create_all(connection)
+        self.assertEqual(len(migrations.upgrade(self.engine)), len(migrations.MIGRATIONS))
+        self.assertEqual(migrations.check_schema(self.engine), [])
+
+    def test_backfill_order_totals(self):
+        """It should backfill the order totals and keep them up to date afterwards"""
+        migrations.upgrade(self.engine, target=3)
+        self._execute(
+            """INSERT INTO "order" (id, customer_id, order_status) VALUES (1, 1, 'pending'), (2, 1, 'pending')"""
+        )
+        self._execute("INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (1, 1, 2, 2.5), (1, 2, 1, 5)")
+        migrations.upgrade(self.engine)
+        self._execute("INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (2, 1, 3, 1), (1, 3, 1, 1)")
+        self._execute("UPDATE order_items SET quantity = 4 WHERE order_id = 1 AND product_id = 1")
+        self._execute("DELETE FROM order_items WHERE product_id = 2")
+        with self.engine.connect() as connection:
+            rows = connection.execute(text('SELECT id, item_count, total_amount FROM "order" ORDER BY id')).all()
+        self.assertEqual([tuple(row) for row in rows], [(1, 2, 11.0), (2, 1, 3.0)])
+
+    def test_rebuild_invalid_index(self):
+        """It should drop and rebuild an index whose concurrent build failed"""
+        migrations.upgrade(self.engine)
+        # Simulate an interrupted CREATE INDEX CONCURRENTLY
+        self._execute(
+            "UPDATE pg_index SET indisvalid = false WHERE indexrelid = "
+            f"'{SCHEMA}.ix_order_customer_id'::regclass"
+        )
+        self._execute("DELETE FROM schema_migrations WHERE version = 2")
+        self.assertIn("invalid index ix_order_customer_id", migrations.check_schema(self.engine))
+        applied = migrations.upgrade(self.engine)
+        self.assertEqual([m.version for m in applied], [2])
+        self.assertEqual(migrations.check_schema(self.engine), [])
+
+    def test_detect_drift(self):
+        """It should report tables, columns and nullability that differ from the models"""
+        migrations.upgrade(self.engine)
+        self._execute('ALTER TABLE "order" DROP COLUMN order_updated')
+        self._execute("ALTER TABLE order_items ALTER COLUMN price DROP NOT NULL")
+        problems = migrations.check_schema(self.engine)
+        self.assertIn("missing column order.order_updated", problems)
+        self.assertIn("column order_items.price nullable should be False", problems)
+        self._execute("DROP TABLE order_items")
+        self.assertIn("missing table order_items", migrations.check_schema(self.engine))
@@ -23,8 +23,10 @@ import logging
 import os
 from unittest import TestCase
 from unittest.mock import patch
+from sqlalchemy.exc import SQLAlchemyError
 from wsgi import app
 from service.models import Order, OrderItems, db, DataValidationError
+from tests.query_counter import QueryCounter
 from tests.factories import OrderFactory, OrderItemsFactory
 
 DATABASE_URI = os.getenv(
@@ -191,3 +193,52 @@ class TestOrderItem(TestCase):
         new_orderitem = OrderItems()
         with self.assertRaises(DataValidationError):
             new_orderitem.deserialize(serial_orderitem)
+
+    def test_find_by_order_id_with_criteria(self):
+        """It should only return the items of an order that match the criteria"""
+        order = OrderFactory()
+        order.create()
+        other = OrderFactory()
+        other.create()
+        for product_id in (10, 101, 20):
+            OrderItemsFactory(order=order, product_id=product_id).create()
+        OrderItemsFactory(order=other, product_id=10).create()
+
+        items = OrderItems.find_by_order_id(order.id)
+        self.assertEqual([item.product_id for item in items], [10, 101, 20])
+        with QueryCounter() as counter:
+            items = OrderItems.find_by_order_id(order.id, OrderItems.product_prefix_filter("10"))
+        self.assertEqual([item.product_id for item in items], [10, 101])
+        self.assertIn("LIKE", counter.statements[0])
+
+    def test_find_in_order(self):
+        """It should find an Item only through the Order it belongs to"""
+        order = OrderFactory()
+        order.create()
+        item = OrderItemsFactory(order=order)
+        item.create()
+        other = OrderFactory()
+        other.create()
+        self.assertEqual(OrderItems.find_in_order(item.order_id, item.id).id, item.id)
+        self.assertIsNone(OrderItems.find_in_order(other.id, item.id))
+        self.assertTrue(OrderItems.exists(item.id))
+        self.assertFalse(OrderItems.exists(item.id + 1))
+
+    def test_delete_by_id(self):
+        """It should delete an Item in one statement, only if it matches the criteria"""
+        order = OrderFactory()
+        order.create()
+        item = OrderItemsFactory(order=order)
+        item.create()
+        item_id, order_id = item.id, item.order_id
+        self.assertFalse(OrderItems.delete_by_id(item_id, OrderItems.order_id == order_id + 1))
+        with QueryCounter() as counter:
+            self.assertTrue(OrderItems.delete_by_id(item_id, OrderItems.order_id == order_id))
+        self.assertEqual(counter.count, 1)
+        self.assertFalse(OrderItems.exists(item_id))
+        self.assertFalse(OrderItems.delete_by_id(item_id))
+
+    def test_delete_by_id_error(self):
+        """It should roll back and raise a DataValidationError if the delete fails"""
+        with patch("service.models.persistent_base.db.session.scalars", side_effect=SQLAlchemyError("boom")):
+            self.assertRaises(DataValidationError, OrderItems.delete_by_id, 1)
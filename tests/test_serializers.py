@@ -0,0 +1,119 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+# pylint: disable=duplicate-code
+
+"""
+Test cases for the serializers and the JSON provider
+"""
+
+import dataclasses
+import datetime
+import decimal
+import uuid
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.common import status
+from service.models import Order, OrderItems
+from service.models.serializers import ModelSerializer
+from tests.factories import OrderFactory, OrderItemsFactory
+
+MOMENT = datetime.datetime(2025, 3, 1, 12, 30, 15, 250000)
+
+
+@dataclasses.dataclass
+class Point:
+    """A dataclass to encode"""
+
+    x: int
+    y: int
+
+
+def make_order() -> Order:
+    """Returns a transient order with two items"""
+    order = OrderFactory(
+        id=7, customer_id=3, order_status="pending", order_created=MOMENT, order_updated=MOMENT,
+        item_count=2, total_amount=12.5, row_version=1,
+    )
+    order.orderitems = [
+        OrderItemsFactory(id=1, order=None, order_id=7, product_id=10, quantity=1, price=2.5),
+        OrderItemsFactory(id=2, order=None, order_id=7, product_id=20, quantity=2, price=5.0),
+    ]
+    return order
+
+
+######################################################################
+#        S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+class TestSerializers(TestCase):
+    """Serializer and JSON Provider Test Cases"""
+
+    def test_serialize_order(self):
+        """It should serialize every column but the row_version in declaration order with the items nested"""
+        data = make_order().serialize()
+        self.assertEqual(list(data), [
+            "id", "customer_id", "order_status", "order_created", "order_updated",
+            "item_count", "total_amount", "orderitems",
+        ])
+        self.assertEqual(data["order_created"], MOMENT)
+        self.assertEqual(data["orderitems"][1], {"id": 2, "order_id": 7, "product_id": 20, "quantity": 2, "price": 5.0})
+
+    def test_serializer_options(self):
+        """It should leave out excluded columns and handle a single column"""
+        self.assertEqual(ModelSerializer(OrderItems, exclude=("order_id",)).fields,
+                         ("id", "product_id", "quantity", "price"))
+        only_id = ModelSerializer(OrderItems, exclude=("order_id", "product_id", "quantity", "price"))
+        self.assertEqual(only_id.many(make_order().orderitems), [{"id": 1}, {"id": 2}])
+
+    def test_project(self):
+        """It should pick the fields of a narrower serializer out of a serialized order"""
+        sparse = ModelSerializer(Order, nested={"orderitems": ModelSerializer(OrderItems, only=("id",))},
+                                 only=("total_amount", "id"))
+        self.assertEqual(sparse.fields, ("id", "total_amount"))
+        order = make_order()
+        self.assertEqual(sparse.project(order.serialize()), sparse(order))
+        self.assertEqual(sparse(order)["orderitems"], [{"id": 1}, {"id": 2}])
+
+    def test_dumps(self):
+        """It should keep key order and write ISO-8601 datetimes and other special values"""
+        value = {
+            "b": MOMENT, "a": MOMENT.date(), "t": MOMENT.time(), "d": decimal.Decimal("1.10"),
+            "u": uuid.UUID(int=1), "p": Point(1, 2), "s": "é",
+        }
+        expected = (
+            '{"b":"2025-03-01T12:30:15.250000","a":"2025-03-01","t":"12:30:15.250000","d":"1.10",'
+            '"u":"00000000-0000-0000-0000-000000000001","p":{"x":1,"y":2},"s":"é"}'
+        )
+        self.assertEqual(app.json.dumps(value), expected)
+        with patch("service.common.json_provider.orjson", None):
+            self.assertEqual(app.json.dumps(value), expected)
+            self.assertEqual(app.json.loads(expected)["s"], "é")
+        self.assertEqual(app.json.loads(expected.encode("utf-8"))["p"], {"x": 1, "y": 2})
+        self.assertEqual(app.json.dumps([1], indent=None), "[1]")
+        with self.assertRaises(TypeError):
+            app.json.dumps(object())
+
+    def test_responses(self):
+        """It should send responses and error bodies through the provider"""
+        with app.test_request_context():
+            response = app.json.response(make_order().serialize())
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertIn(b'"order_created":"2025-03-01T12:30:15.250000"', response.data)
+        # A context of its own, whose teardown ends the transaction of the lookup
+        with app.app_context():
+            resp = app.test_client().get("/orders/0")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(resp.data.startswith(b'{"status":404,'))